@@ -0,0 +1,63 @@
+import numpy as np
+from timeit import default_timer as timer
+
+from gym_hideseek.env import pathing
+from gym_hideseek.env.labyrinth import Labyrinth
+
+direction = [[-1, 0], [1, 0], [0, -1], [0, 1]] # U D L R
+
+def _get_args():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=str, nargs='+', default=['10x15', '50x50', '200x200'], help='Maze sizes as HxW')
+    parser.add_argument('--repeat', type=int, default=20, help='BFS runs per measurement')
+    parser.add_argument('--window-ratio', type=float, default=.1)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+def queue_bfs(field, h, w, sources):
+    '''The queue.Queue BFS the scripted AIs used to run every step'''
+    from queue import Queue
+    dist = np.full([h, w], h*w+1, dtype=np.int32)
+    for s in sources:
+        q = Queue()
+        q.put(s)
+        dist[s[0], s[1]] = 0
+        while not q.empty() > 0:
+            p = q.get()
+            d = dist[p[0], p[1]]
+            for i in range(4):
+                if field[i, p[0], p[1]] == 0:
+                    newp = [p[0]+direction[i][0], p[1]+direction[i][1]]
+                    if dist[newp[0], newp[1]] > d+1:
+                        dist[newp[0], newp[1]] = d+1
+                        q.put(newp)
+    return dist
+
+def pathing_bfs(field, h, w, sources):
+    roots = np.zeros([h, w], dtype=bool)
+    for s in sources:
+        roots[s[0], s[1]] = True
+    return pathing.distance_field(pathing.passable(field), roots)
+
+def measure(fn, repeat, *args):
+    fn(*args) # warm up
+    start = timer()
+    for _ in range(repeat):
+        res = fn(*args)
+    return (timer() - start) / repeat, res
+
+if __name__ == '__main__':
+    args = _get_args()
+    rand = np.random.RandomState(args.seed)
+    lbr = Labyrinth()
+    print('{:>9} {:>8} {:>12} {:>12} {:>8}'.format('size', 'sources', 'queue (ms)', 'pathing (ms)', 'speedup'))
+    for size in args.sizes:
+        h, w = map(int, size.split('x'))
+        lbr.generate(h, w, 0, args.window_ratio, rand)
+        for n_src in (1, 2):
+            sources = [[rand.randint(0, h), rand.randint(0, w)] for _ in range(n_src)]
+            t_queue, ref = measure(queue_bfs, max(1, args.repeat // 10), lbr.field, h, w, sources)
+            t_path, res = measure(pathing_bfs, args.repeat, lbr.field, h, w, sources)
+            assert (ref == res).all()
+            print('{:>9} {:>8} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(size, n_src, t_queue*1e3, t_path*1e3, t_queue/t_path))
@@ -0,0 +1,210 @@
+import json
+import subprocess
+import sys
+import tracemalloc
+from itertools import product
+from time import perf_counter
+
+import numpy as np
+
+import gym_hideseek.env as hs_env
+from gym_hideseek.env.labyrinth import Labyrinth
+
+# metrics where a larger value is better; every other metric is a latency or a size
+higher_is_better = {'steps_per_sec', 'resets_per_sec', 'generates_per_sec', 'renders_per_sec'}
+
+# modules a bare `import gym_hideseek.env` must not load; every Ray worker pays for them
+heavy_modules = ['torch', 'ray', 'importlib_metadata', 'pyglet', 'tensorflow']
+
+_import_probe = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import gym_hideseek.env
+print(json.dumps({
+    'import_seconds': time.perf_counter() - start,
+    'import_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    'heavy_modules': sum(m in sys.modules for m in %r),
+}))
+'''
+
+def _get_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark env step, reset, maze generation and rendering')
+    parser.add_argument('--envs', type=str, nargs='+', default=['Hider', 'Seeker', 'VecHider', 'VecSeeker'], help='Env classes from gym_hideseek.env')
+    parser.add_argument('--sizes', type=str, nargs='+', default=['10x15', '50x50'], help='Maze sizes as HxW')
+    parser.add_argument('--connectivity', type=float, nargs='+', default=[0.])
+    parser.add_argument('--window-ratio', type=float, nargs='+', default=[.1])
+    parser.add_argument('--steps', type=int, default=2000, help='Env steps per case')
+    parser.add_argument('--resets', type=int, default=50, help='Resets, maze generations and renders per case')
+    parser.add_argument('--num-envs', type=int, default=64, help='Sub-envs of the Vec* and subprocess envs')
+    parser.add_argument('--subproc-workers', type=int, nargs='*', default=[], help='Also run SubprocVecEnv over each --envs single env with these worker counts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', type=str, help='Save the results as JSON')
+    parser.add_argument('--compare', type=str, help='Baseline JSON to compare against; exits with 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=.2, help='Allowed relative slowdown before --compare fails')
+    parser.add_argument('--import-budget-s', type=float, default=1., help='Exit with 1 when importing gym_hideseek.env takes longer')
+    parser.add_argument('--import-budget-mb', type=float, default=150., help='Exit with 1 when importing gym_hideseek.env peaks above this RSS')
+    return parser.parse_args()
+
+def _make_env(name, h, w, conn, window_ratio, args):
+    if name.startswith('Subproc'):
+        env_name, workers = name[len('Subproc'):].split('x')
+        env_config = {'h': h, 'w': w, 'connectivity': conn, 'window_ratio': window_ratio}
+        env = hs_env.SubprocVecEnv(env_name, args.num_envs, int(workers), env_config, seed=args.seed)
+        env.reset()
+        return env
+    cls = getattr(hs_env, name)
+    if name.startswith('Vec'):
+        env = cls(args.num_envs, h, w, conn, window_ratio)
+    else:
+        env = cls(h, w, conn, window_ratio)
+    env.seed(args.seed)
+    env.reset()
+    return env
+
+def _sample_actions(env, n, rand):
+    if isinstance(env, hs_env.SubprocVecEnv):
+        space = env.single_action_space
+        shape = (env.num_envs,) + (tuple(space.nvec.shape) if hasattr(space, 'nvec') else ())
+    else:
+        shape = tuple(env.action_space.nvec.shape) if hasattr(env.action_space, 'nvec') else ()
+    return rand.randint(0, 5, size=(n,) + shape)
+
+def _run(env, args, rand):
+    '''Time env steps, resets and renders of one case'''
+    vec = hasattr(env, 'num_envs')
+    actions = _sample_actions(env, args.steps, rand)
+    latency = np.empty(args.steps)
+    for i, action in enumerate(actions):
+        start = perf_counter()
+        _, _, done, _ = env.step(action if vec or action.ndim else int(action))
+        latency[i] = perf_counter() - start
+        if not vec and done:
+            env.reset()
+    env_steps = args.steps * (env.num_envs if vec else 1)
+
+    start = perf_counter()
+    for _ in range(args.resets):
+        env.reset()
+    reset_time = perf_counter() - start
+
+    results = {
+        'steps_per_sec': env_steps / latency.sum(),
+        'step_p50_us': float(np.percentile(latency, 50) * 1e6),
+        'step_p99_us': float(np.percentile(latency, 99) * 1e6),
+        'resets_per_sec': args.resets / reset_time,
+    }
+
+    if hasattr(env, 'render'):
+        start = perf_counter()
+        for _ in range(args.resets):
+            env.render('rgb_array')
+        results['renders_per_sec'] = args.resets / (perf_counter() - start)
+    return results
+
+def _run_closed(env, args, rand):
+    try:
+        return _run(env, args, rand)
+    finally:
+        env.close()
+
+def _peak_memory(fn):
+    '''Peak traced allocation, in bytes, while running fn'''
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def _replace(args, **changes):
+    from argparse import Namespace
+    values = vars(args).copy()
+    values.update(changes)
+    return Namespace(**values)
+
+def import_cost():
+    '''Time and peak RSS of importing gym_hideseek.env in a fresh interpreter'''
+    out = subprocess.run([sys.executable, '-c', _import_probe % (heavy_modules,)], check=True, stdout=subprocess.PIPE)
+    return json.loads(out.stdout.decode().strip().splitlines()[-1])
+
+def check_import(cost, budget_s, budget_mb):
+    '''Return the messages of every import budget the import_cost() result breaks'''
+    failures = []
+    if cost['heavy_modules']:
+        failures.append('{} of {} loaded'.format(cost['heavy_modules'], ', '.join(heavy_modules)))
+    if cost['import_seconds'] > budget_s:
+        failures.append('took {:.3g}s, budget {:.3g}s'.format(cost['import_seconds'], budget_s))
+    if cost['import_rss_bytes'] > budget_mb * 2**20:
+        failures.append('peak RSS {:.4g}MB, budget {:.4g}MB'.format(cost['import_rss_bytes'] / 2**20, budget_mb))
+    return failures
+
+def run_benchmarks(args):
+    results = {'import/gym_hideseek.env': import_cost()}
+    print('import/gym_hideseek.env', _format(results['import/gym_hideseek.env']), flush=True)
+    for (size, conn, window_ratio) in product(args.sizes, args.connectivity, args.window_ratio):
+        h, w = map(int, size.split('x'))
+        rand = np.random.RandomState(args.seed)
+
+        lbr = Labyrinth()
+        start = perf_counter()
+        for _ in range(args.resets):
+            lbr.generate(h, w, conn, window_ratio, rand)
+        key = 'Labyrinth.generate/{}/c{}/r{}'.format(size, conn, window_ratio)
+        results[key] = {
+            'generates_per_sec': args.resets / (perf_counter() - start),
+            'peak_bytes': _peak_memory(lambda: lbr.generate(h, w, conn, window_ratio, rand)),
+        }
+        print(key, _format(results[key]), flush=True)
+
+        subproc = ['Subproc{}x{}'.format(name, n) for name in args.envs if not name.startswith('Vec') for n in args.subproc_workers]
+        for name in args.envs + subproc:
+            key = '{}/{}/c{}/r{}'.format(name, size, conn, window_ratio)
+            env = _make_env(name, h, w, conn, window_ratio, args)
+            results[key] = _run(env, args, rand)
+            env.close()
+            short = _replace(args, steps=max(1, args.steps // 10), resets=1)
+            results[key]['peak_bytes'] = _peak_memory(lambda: _run_closed(_make_env(name, h, w, conn, window_ratio, short), short, rand))
+            print(key, _format(results[key]), flush=True)
+    return results
+
+def _format(metrics):
+    return ' '.join('{}={:.4g}'.format(k, v) for k, v in metrics.items())
+
+def compare(results, baseline, tolerance):
+    '''Return the (case, metric, baseline, current) entries that regressed beyond tolerance'''
+    regressions = []
+    for key, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(key, {}).get(metric)
+            if base is None:
+                continue
+            if metric in higher_is_better:
+                worse = value < base * (1 - tolerance)
+            else:
+                worse = value > base * (1 + tolerance)
+            if worse:
+                regressions.append((key, metric, base, value))
+    return regressions
+
+if __name__ == '__main__':
+    args = _get_args()
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    # the import budget holds with or without a baseline
+    failures = check_import(results['import/gym_hideseek.env'], args.import_budget_s, args.import_budget_mb)
+    for failure in failures:
+        print('IMPORT BUDGET gym_hideseek.env {}'.format(failure))
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for key, metric, base, value in regressions:
+            print('REGRESSION {} {}: {:.4g} -> {:.4g}'.format(key, metric, base, value))
+        if regressions or failures:
+            sys.exit(1)
+        print('No regressions beyond {:.0%} against {}'.format(args.tolerance, args.compare))
+    elif failures:
+        sys.exit(1)
@@ -0,0 +1,188 @@
+import json
+import os
+from argparse import Namespace
+from time import perf_counter
+
+import numpy as np
+
+import ray
+import gym_hideseek.env as hs_env
+from gym_hideseek.env.maze_bank import MazeBank
+
+# the catch rate is the share of episodes that ended with a seeker on the hider,
+# the survival length is the steps an episode lasted (max_steps + 1 without a catch)
+_sides = {'TD-Hider': 'hider', 'TD-Seeker': 'seeker', 'TD-HideSeek': None}
+_opponent = {'hider': 'seeker', 'seeker': 'hider'}
+
+def _get_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='Evaluate an RLlib checkpoint against the scripted opponent on a fixed maze set')
+    parser.add_argument('--checkpoint', type=str, required=True, help='The checkpoint file to restore')
+    parser.add_argument('-m', '--method', type=str, default='PPO', help='The RLlib-registered algorithm of the checkpoint')
+    parser.add_argument('-C', '--model-config', type=str, required=True, help='The model config file used for training')
+    parser.add_argument('-E', '--env', type=str, required=True, choices=list(_sides), help='Environment')
+    parser.add_argument('--env-config', type=str, required=True, help='The environment config file')
+    parser.add_argument('--policy', type=str, help='With TD-HideSeek, the policy to evaluate: hider or seeker')
+    parser.add_argument('-n', '--episodes', type=int, default=1000, help='Episodes to play, one per evaluation maze')
+    parser.add_argument('--num-envs', type=int, default=256, help='Envs stepped together, one batched inference per step')
+    parser.add_argument('--maze-bank', type=str, help='Evaluation maze bank; generated there when missing (default eval_mazes/<env config>)')
+    parser.add_argument('--seed', type=int, default=0, help='Seeds the evaluation mazes and, with + i, the spawns of episode i')
+    parser.add_argument('--bins', type=int, default=10, help='Histogram bins of the survival lengths')
+    parser.add_argument('-o', '--output', type=str, help='Save the results as JSON')
+    return parser.parse_args()
+
+def _maze_bank(path, episodes, env_config, seed):
+    '''Open the evaluation bank at path, creating it on first use.
+
+    The bank is only generated once, so every checkpoint evaluated against
+    it plays the same mazes; it must hold one maze per episode.
+    '''
+    h, w = env_config['h'], env_config['w']
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        print('Generating {} evaluation mazes in {}'.format(episodes, path))
+        return MazeBank.create(path, episodes, h, w, env_config['connectivity'], env_config['window_ratio'], seed)
+    bank = MazeBank(path)
+    meta = bank.meta
+    assert (meta['h'], meta['w'], meta['connectivity'], meta['window_ratio']) == \
+        (h, w, env_config['connectivity'], env_config['window_ratio']), 'maze bank {} does not match the env config'.format(path)
+    assert len(bank) >= episodes, 'maze bank {} holds {} mazes, fewer than {} episodes'.format(path, len(bank), episodes)
+    return bank
+
+def _load_policy(args, env_config):
+    '''Restore the checkpoint into a CPU-only trainer without rollout workers'''
+    from ray.rllib.agents.registry import get_trainer_class
+    import train
+
+    config, _ = train._get_config(Namespace(
+        env=args.env, model_config=args.model_config, env_config=args.env_config,
+        profile_env=False, curriculum=None, num_workers=0, lr=0., render_env=False, record_env=False,
+    ))
+    config.update(env_config=env_config, num_gpus=0, explore=False)
+    trainer = get_trainer_class(args.method)(config=config)
+    trainer.restore(args.checkpoint)
+    return trainer.get_policy(args.policy or 'default_policy')
+
+class _OneSide:
+    '''A HideSeekMultiAgent whose other side is scripted, stepped like Hider/Seeker'''
+    def __init__(self, env, side) -> None:
+        self.env = env
+        self.side = side
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+    def reset(self, options = None):
+        return self.env.reset(options)[self.side]
+
+    def step(self, action):
+        obs, rewards, dones, infos = self.env.step({self.side: action})
+        return obs[self.side], rewards[self.side], dones['__all__'], infos[self.side]
+
+def evaluate(policy, make_env, episodes, num_envs = 256, seed = 0):
+    '''Play episode i on maze i of the env's maze bank, spawned from seed + i.
+
+    Up to num_envs episodes run at once and every step their observations
+    go through one policy.compute_actions call. Episodes are seeded and
+    assigned mazes by index, so the results do not depend on num_envs.
+    Returns (caught, lengths, timings).
+    '''
+    envs = [make_env() for _ in range(min(num_envs, episodes))]
+    caught = np.zeros(episodes, dtype=bool)
+    lengths = np.zeros(episodes, dtype=np.int64)
+    episode = [None] * len(envs)
+    obs = [None] * len(envs)
+    started = 0
+    timings = {'inference': 0., 'env': 0.}
+
+    def start(k):
+        nonlocal started
+        episode[k] = started
+        envs[k].seed(seed + started)
+        obs[k] = envs[k].reset(options={'maze': started})
+        started += 1
+
+    for k in range(len(envs)):
+        start(k)
+    active = list(range(len(envs)))
+    steps = 0
+    while active:
+        t = perf_counter()
+        actions = policy.compute_actions(np.stack([obs[k] for k in active]), explore=False)[0]
+        timings['inference'] += perf_counter() - t
+
+        t = perf_counter()
+        running = []
+        for k, action in zip(active, actions):
+            env = envs[k]
+            obs[k], _, done, _ = env.step(action)
+            if not done:
+                running.append(k)
+                continue
+            caught[episode[k]] = env.check_catch()
+            lengths[episode[k]] = env.steps
+            if started < episodes:
+                start(k)
+                running.append(k)
+        steps += len(active)
+        active = running
+        timings['env'] += perf_counter() - t
+    for env in envs:
+        env.close()
+    timings['steps'] = steps
+    return caught, lengths, timings
+
+def summarize(caught, lengths, timings, bins = 10) -> dict:
+    seconds = timings['inference'] + timings['env']
+    counts, edges = np.histogram(lengths, bins=bins)
+    return {
+        'episodes': len(caught),
+        'catch_rate': float(caught.mean()),
+        'survival_mean': float(lengths.mean()),
+        'survival_std': float(lengths.std()),
+        'survival_percentiles': {str(p): float(np.percentile(lengths, p)) for p in (5, 25, 50, 75, 95)},
+        'survival_histogram': {'counts': counts.tolist(), 'edges': edges.tolist()},
+        'caught_survival_mean': float(lengths[caught].mean()) if caught.any() else None,
+        'steps': int(timings['steps']),
+        'steps_per_sec': timings['steps'] / seconds,
+        'episodes_per_sec': len(caught) / seconds,
+        'inference_share': timings['inference'] / seconds,
+    }
+
+if __name__ == '__main__':
+    args = _get_args()
+    with open(args.env_config, 'r') as f:
+        env_config = json.load(f)
+    # the evaluation mazes come from the bank, so drop the training-time maze sources
+    for key in ('maze_service', 'maze_bank', 'profile'):
+        env_config.pop(key, None)
+    path = args.maze_bank or os.path.join('eval_mazes', '{h}x{w}_c{connectivity}_r{window_ratio}'.format(**env_config) + '_s{}'.format(args.seed))
+    _maze_bank(path, args.episodes, env_config, args.seed)
+    env_config['maze_bank'] = path
+
+    side = _sides[args.env]
+    if side is None:
+        # a self-play checkpoint: the evaluated policy plays against the scripted other side
+        assert args.policy in _opponent, '--policy must be hider or seeker with TD-HideSeek'
+        side = args.policy
+        env_config['scripted'] = _opponent[side]
+        from gym_hideseek.env.multi_agent import HideSeekMultiAgent
+        make_env = lambda: _OneSide(HideSeekMultiAgent(**env_config), side)
+    else:
+        env_class = getattr(hs_env, args.env[len('TD-'):])
+        make_env = lambda: env_class(**env_config)
+
+    ray.init()
+    policy = _load_policy(args, env_config)
+    caught, lengths, timings = evaluate(policy, make_env, args.episodes, args.num_envs, args.seed)
+    results = summarize(caught, lengths, timings, args.bins)
+    results.update(checkpoint=args.checkpoint, env=args.env, side=side, maze_bank=path, seed=args.seed)
+    ray.shutdown()
+
+    print('{} episodes on {}: catch rate {:.3f}, survival mean {:.1f} (p5/p50/p95 {}/{}/{}), {:.0f} steps/s ({:.0%} inference)'.format(
+        results['episodes'], path, results['catch_rate'], results['survival_mean'],
+        *(results['survival_percentiles'][p] for p in ('5', '50', '95')),
+        results['steps_per_sec'], results['inference_share'],
+    ))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -1 +1,29 @@
-from gym_hideseek.env.hide_seek import Hider, Seeker
\ No newline at end of file
+from gym_hideseek.env.hide_seek import Hider, Seeker, EnvState
+from gym_hideseek.env.vec_hide_seek import VecHideSeek, VecHider, VecSeeker
+from gym_hideseek.env.maze_bank import MazeBank
+from gym_hideseek.env.maze_service import MazeService
+from gym_hideseek.env.maze_index import MazeIndex
+from gym_hideseek.env.visibility import VisibilityIndex
+
+# loaded on first access, so importing the env does not pull in
+# multiprocessing, the recorder, the dataset tools or ray
+_lazy = {
+    'EpisodeRecorder': 'gym_hideseek.env.recorder',
+    'EpisodeReader': 'gym_hideseek.env.recorder',
+    'SubprocVecEnv': 'gym_hideseek.env.subproc',
+    'HideSeekMultiAgent': 'gym_hideseek.env.multi_agent',
+    'TransitionReader': 'gym_hideseek.env.dataset',
+}
+
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    import importlib
+    value = getattr(importlib.import_module(_lazy[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy))
@@ -0,0 +1,236 @@
+import json
+import multiprocessing as mp
+import os
+
+import numpy as np
+
+from gym_hideseek.env.maze_bank import pack_field, unpack_field
+from gym_hideseek.env.vec_hide_seek import VecHider, VecSeeker
+
+# A dataset is a directory holding meta.json and shards, each shard a
+# directory with one .npy file per column plus mazes.npy, the [M, h, w]
+# packed cells (see pack_field) its maze column indexes. Every row is one
+# transition: the positions after step steps, the action taken from them,
+# and the reward and done it led to.
+_vec_classes = {'hider': VecHider, 'seeker': VecSeeker}
+
+
+def _columns(side, n_seekers):
+    '''(dtype, shape) of every column; action holds the actions of side'''
+    n_actions = 1 if side == 'hider' else n_seekers
+    return {
+        'maze': ('<u4', ()),
+        'step': ('<u4', ()),
+        'hider': ('<i2', (2,)),
+        'seeker': ('<i2', (n_seekers, 2)),
+        'action': ('i1', (n_actions,)),
+        'reward': ('i1', ()),
+        'done': ('u1', ()),
+    }
+
+
+class ShardWriter:
+    '''Collect transitions and write them as shards of about shard_rows rows.
+
+    Mazes are deduplicated per shard: maze_id() returns the row of the
+    shard's side table holding the maze, adding it on first use, and the
+    table starts over with every shard.
+    '''
+    def __init__(self, path, prefix, columns, shard_rows = 1 << 20) -> None:
+        self.path = path
+        self.prefix = prefix
+        self.columns = columns
+        self.shard_rows = shard_rows
+        self.shards = [] # (name, rows, mazes) of every written shard
+        self._start()
+
+    def _start(self):
+        self._parts = {name: [] for name in self.columns}
+        self._rows = 0
+        self._ids = {}
+        self._mazes = []
+
+    def maze_id(self, cells) -> int:
+        '''Side table row of the packed [h, w] maze cells'''
+        key = cells.tobytes()
+        i = self._ids.get(key)
+        if i is None:
+            i = self._ids[key] = len(self._mazes)
+            self._mazes.append(cells)
+        return i
+
+    def append(self, **columns) -> None:
+        '''Add rows given as one array per column, with maze ids from maze_id()'''
+        for name, (dtype, _) in self.columns.items():
+            self._parts[name].append(np.asarray(columns[name], dtype=dtype))
+        self._rows += len(columns['maze'])
+        if self._rows >= self.shard_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        name = '{}-{:05d}'.format(self.prefix, len(self.shards))
+        shard = os.path.join(self.path, name)
+        os.makedirs(shard, exist_ok=True)
+        for column, parts in self._parts.items():
+            np.save(os.path.join(shard, column + '.npy'), np.concatenate(parts))
+        np.save(os.path.join(shard, 'mazes.npy'), np.stack(self._mazes))
+        self.shards.append({'name': name, 'rows': self._rows, 'mazes': len(self._mazes)})
+        self._start()
+
+
+def _rollout(path, worker, rows, side, h, w, connectivity, window_ratio, n_seekers, num_envs, shard_rows, seed):
+    '''Play rows transitions of scripted games in num_envs batched envs and write them; returns the shards'''
+    vec = _vec_classes[side](num_envs, h, w, connectivity, window_ratio, n_seekers)
+    vec.seed(None if seed is None else seed + worker * num_envs)
+    vec.reset()
+    cells = list(pack_field(vec.field))
+    writer = ShardWriter(path, 'shard-{:03d}'.format(worker), _columns(side, n_seekers), shard_rows)
+    written = 0
+    while written < rows:
+        action = vec.hider_actions()[:, None] if side == 'hider' else vec.seeker_actions()
+        maze = [writer.maze_id(c) for c in cells]
+        step, hider, seeker = vec.steps.copy(), vec.hider.copy(), vec.seeker.copy()
+        reward, done = vec.advance(action[:, 0] if side == 'hider' else action)
+        take = min(num_envs, rows - written)
+        writer.append(
+            maze=maze[:take], step=step[:take], hider=hider[:take], seeker=seeker[:take],
+            action=action[:take], reward=reward[:take], done=done[:take]
+        )
+        written += take
+        for i in np.flatnonzero(done):
+            vec.reset_at(i)
+            cells[i] = pack_field(vec.field[i])
+    writer.flush()
+    return writer.shards
+
+
+def export(path, rows, side = 'hider', h = 10, w = 15, connectivity = 0, window_ratio = .1, n_seekers = 2,
+           num_envs = 256, num_workers = 1, shard_rows = 1 << 20, seed = None, context = None) -> 'TransitionReader':
+    '''Write rows transitions of hider_ai-vs-seeker_ai games to a new dataset at path.
+
+    The games follow the env of side: with 'hider' they play like Hider
+    driven by hider_ai, with 'seeker' like Seeker driven by one seeker_ai
+    chase step, and the action column holds the actions of that side.
+    Each of the num_workers processes steps num_envs games at once with
+    VecHider/VecSeeker, env i of worker k seeded with seed + k*num_envs + i,
+    and writes its own shards. The games still running when the row
+    budget is reached are cut off there.
+    '''
+    assert side in _vec_classes, 'side must be hider or seeker'
+    os.makedirs(path, exist_ok=True)
+    bounds = np.linspace(0, rows, num_workers + 1).astype(int)
+    jobs = [
+        (path, k, int(hi - lo), side, h, w, connectivity, window_ratio, n_seekers, num_envs, shard_rows, seed)
+        for k, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:]))
+    ]
+    if num_workers == 1:
+        shards = [_rollout(*jobs[0])]
+    else:
+        with mp.get_context(context).Pool(num_workers) as pool:
+            shards = pool.starmap(_rollout, jobs)
+    columns = _columns(side, n_seekers)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({
+            'h': h, 'w': w, 'connectivity': connectivity, 'window_ratio': window_ratio,
+            'side': side, 'n_seekers': n_seekers, 'seed': seed, 'rows': int(rows),
+            'columns': {name: [dtype, list(shape)] for name, (dtype, shape) in columns.items()},
+            'shards': [shard for part in shards for shard in part],
+        }, f, indent=4)
+    return TransitionReader(path)
+
+
+def observations(batch) -> np.ndarray:
+    '''The float32 [B, h, w, 10] Hider/Seeker observations of the rows of a batch'''
+    field = unpack_field(batch['maze'])
+    b = np.arange(len(field))
+    s = np.zeros(field.shape[:1] + field.shape[2:] + (10,), dtype=np.float32)
+    s[..., 0:8] = field.transpose([0, 2, 3, 1])
+    s[b, batch['hider'][:, 0], batch['hider'][:, 1], 8] = 1
+    s[b[:, None], batch['seeker'][..., 0], batch['seeker'][..., 1], 9] = 1
+    return s
+
+
+class TransitionReader:
+    '''Stream minibatches from a dataset written by export().
+
+    Shards are opened with mmap_mode='r' and read one block of block_rows
+    rows at a time, so memory holds at most the shuffle buffer, never a
+    whole shard.
+    '''
+    def __init__(self, path) -> None:
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.h = self.meta['h']
+        self.w = self.meta['w']
+        self.columns = list(self.meta['columns'])
+        self.shards = self.meta['shards']
+
+    def __len__(self) -> int:
+        return sum(shard['rows'] for shard in self.shards)
+
+    def shard(self, i) -> dict:
+        '''The memory-mapped columns and mazes side table of shard i'''
+        root = os.path.join(self.path, self.shards[i]['name'])
+        return {name: np.load(os.path.join(root, name + '.npy'), mmap_mode='r') for name in self.columns + ['mazes']}
+
+    def _block(self, i, start, block_rows):
+        shard = self.shard(i)
+        part = {name: np.array(shard[name][start:start+block_rows]) for name in self.columns}
+        # resolve maze ids, which are only valid within their shard
+        part['maze'] = np.array(shard['mazes'][part['maze']])
+        return part
+
+    def batches(self, batch_size, shuffle = True, seed = None, block_rows = 4096, buffer_blocks = 16, drop_last = False):
+        '''Yield dicts of [batch_size, ...] column arrays, 'maze' holding the packed [h, w] cells.
+
+        With shuffle the blocks are visited in random order and rows are
+        shuffled within a buffer of buffer_blocks blocks.
+        '''
+        rand = np.random.RandomState(seed)
+        blocks = [(i, start) for i, shard in enumerate(self.shards) for start in range(0, shard['rows'], block_rows)]
+        if shuffle:
+            blocks = [blocks[j] for j in rand.permutation(len(blocks))]
+        rest = None
+        for first in range(0, len(blocks), buffer_blocks):
+            parts = [self._block(i, start, block_rows) for i, start in blocks[first:first+buffer_blocks]]
+            if rest is not None:
+                parts.insert(0, rest)
+            buf = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+            n = len(buf['maze'])
+            if shuffle:
+                order = rand.permutation(n)
+                buf = {name: column[order] for name, column in buf.items()}
+            end = n - n % batch_size
+            for start in range(0, end, batch_size):
+                yield {name: column[start:start+batch_size] for name, column in buf.items()}
+            rest = {name: column[end:] for name, column in buf.items()}
+        if rest is not None and len(rest['maze']) and not drop_last:
+            yield rest
+
+
+def _get_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='Export scripted Hide_Seek games as a transition dataset')
+    parser.add_argument('--env-config', type=str, required=True, help='The environment config file')
+    parser.add_argument('-n', '--rows', type=int, required=True, help='Number of transitions')
+    parser.add_argument('-o', '--output', type=str, required=True, help='Output dataset directory')
+    parser.add_argument('--side', type=str, default='hider', choices=list(_vec_classes), help='The env whose actions are recorded')
+    parser.add_argument('--num-envs', type=int, default=256, help='Games stepped together per worker')
+    parser.add_argument('-N', '--num-workers', type=int, default=1)
+    parser.add_argument('--shard-rows', type=int, default=1 << 20)
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = _get_args()
+    with open(args.env_config, 'r') as f:
+        env_config = json.load(f)
+    reader = export(
+        args.output, args.rows, args.side, env_config['h'], env_config['w'],
+        env_config['connectivity'], env_config['window_ratio'], env_config.get('n_seekers', 2),
+        num_envs=args.num_envs, num_workers=args.num_workers, shard_rows=args.shard_rows, seed=args.seed
+    )
+    print('Wrote {} transitions in {} shards to {}'.format(len(reader), len(reader.shards), args.output))
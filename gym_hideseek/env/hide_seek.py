@@ -1,12 +1,25 @@
 import gym
-from gym import spaces, utils
+from gym import spaces
 from gym.utils import seeding
-from importlib_metadata import metadata
+from collections import namedtuple
+from time import perf_counter
 
 import numpy as np
-from torch import layer_norm
 
+from gym_hideseek.env import raster
 from gym_hideseek.env.labyrinth import Labyrinth
+from gym_hideseek.env.maze_bank import MazeBank, pack_field
+from gym_hideseek.env.maze_service import MazeService
+from gym_hideseek.env.vec_hide_seek import VecHider, VecSeeker
+
+
+# A snapshot of a game. maze is the episode's Labyrinth, shared by reference;
+# hider and seeker are tuples of (y, x) pairs; rng is the np_random state,
+# which the next reset() draws from.
+EnvState = namedtuple('EnvState', ['maze', 'hider', 'seeker', 'steps', 'rng'])
+
+# Hide_Seek.direction as plain tuples, for the per-agent Python loops
+_steps = ((-1, 0), (1, 0), (0, -1), (0, 1), (0, 0))
 
 
 class Hide_Seek(gym.Env):
@@ -15,244 +28,672 @@ class Hide_Seek(gym.Env):
         'video.frames_per_second': 24
     }
         
-    direction = [[-1, 0], [1, 0], [0, -1], [0, 1], [0, 0]] # U D L R NOP
+    direction = np.array([[-1, 0], [1, 0], [0, -1], [0, 1], [0, 0]], dtype=np.int64) # U D L R NOP
+    obs_encodings = ['float32', 'uint8', 'packed']
+    spawn_modes = ['uniform', 'far']
+    max_rejects = 100 # mazes drawn per reset before a degenerate one is accepted anyway
+    controls = 'hider' # the side the env is played from
+    ai_distance_rows = 4 # up to this many targets the scripted AIs min cached distance rows, then one BFS
+    loop_agents = 4 # up to this many agents per side, moves are applied in Python loops, then vectorized
+    full_view_cells = 64 * 64 # larger mazes need a view_radius with partial_obs
+    _vec_class = None # batched twin used by simulate()
+    phases = ['action', 'opponent_ai', 'catch', 'observation', 'reset']
+    _profiled = {
+        'move_hider': 'action', 'move_seekers': 'action',
+        'seeker_ai': 'opponent_ai', 'hider_ai': 'opponent_ai',
+        'check_catch': 'catch',
+        '_draw_agents': 'observation', '_observe': 'observation',
+        '_take_episode': 'reset',
+    }
     
-    def __init__(self, h, w, connectivity, window_ratio) -> None:
+    def __init__(self, h, w, connectivity, window_ratio, maze_bank = None, copy_obs = True,
+                 obs_encoding = 'float32', obs_crop = None, render_mode = 'human', profile = False,
+                 max_size = None, maze_service = None, spawn = 'uniform', maze_filter = None,
+                 async_reset = False, n_hiders = 1, n_seekers = 2, partial_obs = False, view_radius = None) -> None:
         super(Hide_Seek, self).__init__()
-        self.observation_space = spaces.Box(low=0., high=1., shape=[h, w, 10], dtype=np.float32)
+        assert n_hiders >= 1 and n_seekers >= 1
+        self.n_hiders = n_hiders
+        self.n_seekers = n_seekers
+        # agents an observation crop is centred on
+        self.n_controlled = n_seekers if self.controls == 'seeker' else n_hiders
+        assert obs_encoding in self.obs_encodings, 'unknown obs_encoding {}'.format(obs_encoding)
+        assert spawn in self.spawn_modes, 'unknown spawn {}'.format(spawn)
+        # spawn='far' puts the seekers at least half the hider's escape distance
+        # away; maze_filter holds MazeIndex.degenerate() thresholds for rejecting mazes
+        self.spawn = spawn
+        self.maze_filter = maze_filter
+        assert obs_crop is None or (obs_crop > 0 and obs_crop % 2 == 1), 'obs_crop must be a positive odd size'
+        self.obs_encoding = obs_encoding
+        self.obs_crop = obs_crop
+        # with partial_obs agents only see the cells in their line of sight
+        # (within view_radius), see _observe_partial. Without a radius every
+        # newly visited cell casts a ray to every other one, O(h*w*(h+w)) per
+        # cell, so mazes beyond full_view_cells must set view_radius
+        self.partial_obs = partial_obs
+        self.view_radius = view_radius
+        self._channels = 11 if partial_obs else 10
+        # with max_size the maze size can change between episodes (see set_level)
+        # while observations keep the max_size shape
+        self.max_h, self.max_w = (h, w) if max_size is None else max_size
+        assert not partial_obs or view_radius is not None or self.max_h * self.max_w <= self.full_view_cells, \
+            'partial_obs on mazes larger than {} cells needs a view_radius'.format(self.full_view_cells)
+        self.observation_space = self._observation_space(self.max_h, self.max_w)
         
-        self.h = h
-        self.w = w
-        self.conn = connectivity
-        self.window_ratio = window_ratio
         self.field = Labyrinth()
-        self.hider = self.seeker = None
+        self.maze_bank = None
+        if maze_bank is not None:
+            self.maze_bank = MazeBank(maze_bank)
+        self._own_service = maze_service is True or isinstance(maze_service, dict)
+        if maze_service is True:
+            maze_service = MazeService()
+        elif isinstance(maze_service, dict):
+            maze_service = MazeService(**maze_service)
+        self.maze_service = maze_service
+        self.h = self.w = None
+        self.set_level(h, w, connectivity, window_ratio)
+        # int [n, 2] (y, x) positions, plus [2, max_h, max_w] counts of hiders and
+        # seekers per cell; both are only changed through _place and _shift,
+        # which collect the (side, y, x) cells whose channel 8/9 needs redrawing in _dirty
+        self.hiders = self.seekers = None
+        self._occupancy = np.zeros([2, self.max_h, self.max_w], dtype=np.int32)
+        self._dirty = set()
+        
+        # observations live in one preallocated buffer: the maze channels are
+        # written at reset() and only the agent cells are updated afterwards.
+        # With obs_crop the buffer has a solid-wall border of obs_crop//2 cells,
+        # and cells beyond a maze smaller than max_size read as solid as well.
+        self.copy_obs = copy_obs
+        self._pad = 0 if obs_crop is None else obs_crop // 2
+        shape = [self.max_h + 2*self._pad, self.max_w + 2*self._pad]
+        if obs_encoding == 'packed':
+            self._obs = np.full(shape, 0b1111, dtype=np.uint16)
+        else:
+            self._obs = np.zeros(shape + [10], dtype=obs_encoding)
+            self._obs[..., 0:4] = 1
+        self._obs_view = self._obs.view()
+        self._obs_view.flags.writeable = False
         
         self.steps = 0
         
+        self.render_mode = render_mode
         self.viewer = None
+        self._maze_layer = None
+        
+        self.profile = None
+        if profile:
+            self._enable_profile()
+        
+        # with async_reset the next episode is drawn in a background thread
+        # while the current one runs; _prefetch_rng is the np_random state
+        # from before that draw, so it can be undone
+        self.async_reset = async_reset
+        self._executor = None
+        self._prefetch = None
+        self._prefetch_rng = None
         
         self.seed()
         self.reset()
     
     def seed(self, seed=None):
+        self._cancel_prefetch()
         self.np_random, seed = seeding.np_random(seed)
+        if self._own_service:
+            # a service built from the env config follows the env seed, not a
+            # seed in that config, which every worker's env would share
+            self.maze_service.reseed(None if seed is None else seed % 2**32)
         return [seed]
     
+    def _rng_state(self):
+        if self._prefetch is not None:
+            return self._prefetch_rng
+        rand = self.np_random
+        return rand.get_state() if hasattr(rand, 'get_state') else rand.bit_generator.state
     
-    def reset(self):
-        self.field.generate(self.h, self.w, self.conn, self.window_ratio, self.np_random)
-        self.hider = [self.np_random.randint(0, self.h), self.np_random.randint(0, self.w)]
-        self.seeker = [
-            [self.np_random.randint(0, self.h), self.np_random.randint(0, self.w)],
-            [self.np_random.randint(0, self.h), self.np_random.randint(0, self.w)]
-        ]
-        self.steps = 0
+    def _set_rng_state(self, state):
+        if hasattr(self.np_random, 'set_state'):
+            self.np_random.set_state(state)
+        else:
+            self.np_random.bit_generator.state = state
+    
+    def _enable_profile(self):
+        '''Time every phase of the episode into self.profile (seconds per phase).
         
-        if self.viewer:
-            self.viewer.close()
-            self.viewer = None
+        The phase methods are wrapped on this instance only, so an env built
+        with profile=False runs the plain methods without any extra cost.
+        '''
+        self.profile = dict.fromkeys(self.phases, 0.)
+        for name, phase in self._profiled.items():
+            setattr(self, name, self._timed(phase, getattr(self, name)))
+    
+    def _timed(self, phase, fn):
+        profile = self.profile
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile[phase] += perf_counter() - start
+        return timed
+    
+    def _info(self):
+        '''Step info; carries the phase times of the episode so far when profiling'''
+        if self.profile is None:
+            return {}
+        return {'profile': dict(self.profile, steps=self.steps)}
+    
+    def set_level(self, h = None, w = None, connectivity = None, window_ratio = None):
+        '''Change the maze size and difficulty used from the next reset() on'''
+        h = self.h if h is None else h
+        w = self.w if w is None else w
+        assert h <= self.max_h and w <= self.max_w, 'maze size {}x{} exceeds max_size'.format(h, w)
+        self._cancel_prefetch()
+        if self.maze_bank is not None:
+            assert (self.maze_bank.h, self.maze_bank.w) == (h, w), 'maze bank size does not match the env'
+        self.h, self.w = h, w
+        if connectivity is not None:
+            self.conn = connectivity
+        if window_ratio is not None:
+            self.window_ratio = window_ratio
+        if self.maze_service is not None:
+            self.maze_service.request(self.h, self.w, self.conn, self.window_ratio)
+    
+    def _new_maze(self, maze = None):
+        # a fresh Labyrinth per episode, so snapshots can keep sharing the old one
+        field = Labyrinth()
+        if maze is not None:
+            self.maze_bank.load(field, maze)
+        elif self.maze_bank is not None:
+            self.maze_bank.load(field, self.np_random.randint(0, len(self.maze_bank)))
+        elif self.maze_service is not None:
+            field.load(self.maze_service.get(self.h, self.w, self.conn, self.window_ratio))
+        else:
+            field.generate(self.h, self.w, self.conn, self.window_ratio, self.np_random)
+        return field
+    
+    def _next_episode(self, maze = None):
+        '''Draw the maze and spawn positions of the next episode from np_random'''
+        field = self._new_maze(maze)
+        if self.maze_filter and maze is None:
+            for _ in range(self.max_rejects):
+                if not field.index.degenerate(**self.maze_filter):
+                    break
+                field = self._new_maze()
+        return (field,) + self._spawn(field)
+    
+    def _take_episode(self, maze = None):
+        if maze is not None:
+            self._cancel_prefetch()
+        if self._prefetch is None:
+            return self._next_episode(maze)
+        episode = self._prefetch.result()
+        self._prefetch = None
+        return episode
+    
+    def _start_prefetch(self):
+        from concurrent.futures import ThreadPoolExecutor
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        self._prefetch_rng = self._rng_state()
+        self._prefetch = self._executor.submit(self._next_episode)
+    
+    def _cancel_prefetch(self):
+        '''Drop the prepared episode and rewind np_random to before it was drawn'''
+        if getattr(self, '_prefetch', None) is None:
+            return
+        self._prefetch.result()
+        self._prefetch = None
+        self._set_rng_state(self._prefetch_rng)
+    
+    def reset(self, options = None):
+        '''Start an episode; options may hold h, w, connectivity and window_ratio for set_level.
+        
+        With async_reset the episode was already drawn in the background
+        during the previous one, from the same np_random sequence, so the
+        episodes are those a synchronous env would play. options['maze']
+        plays maze i of the maze bank instead of a drawn one (the spawn
+        positions still come from np_random).
+        '''
+        maze = None
+        if options:
+            options = dict(options)
+            maze = options.pop('maze', None)
+            assert maze is None or self.maze_bank is not None, 'options["maze"] needs a maze bank'
+            if options:
+                self.set_level(**options)
+        if self.profile is not None:
+            for phase in self.profile:
+                self.profile[phase] = 0.
+        self.field, hiders, seekers = self._take_episode(maze)
+        self.steps = 0
+        self._write_maze()
+        self._place(hiders, seekers)
+        if self.async_reset:
+            self._start_prefetch()
             
         return self.state
     
+    def _spawn(self, field):
+        '''Hider and seeker positions on field'''
+        h, w = field.h, field.w
+        hiders = [[self.np_random.randint(0, h), self.np_random.randint(0, w)] for _ in range(self.n_hiders)]
+        if self.spawn == 'uniform':
+            seekers = [[self.np_random.randint(0, h), self.np_random.randint(0, w)] for _ in range(self.n_seekers)]
+            return hiders, seekers
+        # with one hider the row is cached by the Labyrinth, and is the one seeker_ai starts from
+        dist = field.nearest_distance(np.array(hiders)).ravel()
+        reach = dist <= h * w
+        far = np.flatnonzero(reach & (2 * dist.astype(np.int64) >= dist[reach].max()))
+        return hiders, [list(divmod(int(far[self.np_random.randint(0, len(far))]), w)) for _ in range(self.n_seekers)]
+    
+    @property
+    def hider(self):
+        '''(y, x) of the first hider'''
+        return self.hiders[0]
+    
+    @property
+    def seeker(self):
+        return self.seekers
+    
+    def _mark_agents(self):
+        if self.hiders is not None:
+            self._dirty.update((0, y, x) for y, x in self.hiders.tolist())
+            self._dirty.update((1, y, x) for y, x in self.seekers.tolist())
+    
+    def _count(self, side, pos, n):
+        '''Add n to the occupancy of side at every cell of pos'''
+        occ = self._occupancy[side]
+        if len(pos) <= self.loop_agents:
+            for y, x in pos.tolist():
+                occ[y, x] += n
+        else:
+            np.add.at(occ, (pos[:, 0], pos[:, 1]), n)
+    
+    def _place(self, hiders, seekers):
+        '''Put every agent at new positions and update the occupancy grid'''
+        self._mark_agents()
+        if self.hiders is not None:
+            self._count(0, self.hiders, -1)
+            self._count(1, self.seekers, -1)
+        self.hiders = np.array(hiders, dtype=np.int64).reshape(self.n_hiders, 2)
+        self.seekers = np.array(seekers, dtype=np.int64).reshape(self.n_seekers, 2)
+        self._count(0, self.hiders, 1)
+        self._count(1, self.seekers, 1)
+        self._mark_agents()
+    
+    def _shift(self, side, moves):
+        '''Step each agent of side (0 hiders, 1 seekers) in its direction of moves (4 stays), keeping the occupancy in sync'''
+        pos = self.seekers if side else self.hiders
+        occ = self._occupancy[side]
+        if len(pos) <= self.loop_agents:
+            cells = pos.tolist()
+            for i, d in enumerate(moves):
+                if d != 4:
+                    y, x = cells[i]
+                    dy, dx = _steps[d]
+                    occ[y, x] = occ.item(y, x) - 1
+                    occ[y+dy, x+dx] = occ.item(y+dy, x+dx) + 1
+                    pos[i] = y+dy, x+dx
+                    self._dirty.add((side, y, x))
+                    self._dirty.add((side, y+dy, x+dx))
+            return
+        moves = np.asarray(moves)
+        idx = np.flatnonzero(moves != 4)
+        old = pos[idx]
+        pos[idx] += self.direction[moves[idx]]
+        new = pos[idx]
+        np.subtract.at(occ, (old[:, 0], old[:, 1]), 1)
+        np.add.at(occ, (new[:, 0], new[:, 1]), 1)
+        self._dirty.update((side, y, x) for y, x in old.tolist() + new.tolist())
+    
+    @property
+    def index(self):
+        '''MazeIndex of the current maze'''
+        return self.field.index
+    
+    def _write_maze(self):
+        '''Write the static maze channels of the observation buffer'''
+        if (self.h, self.w) != (self.max_h, self.max_w):
+            region = self._obs[self._pad:self._pad+self.max_h, self._pad:self._pad+self.max_w]
+            if self.obs_encoding == 'packed':
+                region[...] = 0b1111
+            else:
+                region[..., 0:4] = 1
+                region[..., 4:] = 0
+        inner = self._obs[self._pad:self._pad+self.h, self._pad:self._pad+self.w]
+        if self.obs_encoding == 'packed':
+            inner[...] = pack_field(self.field.field)
+        else:
+            inner[..., 0:8] = self.field.field.transpose([1, 2, 0])
+            inner[..., 8:] = 0
+        self._mark_agents()
+        self._maze_layer = None
+    
+    def open_wall(self, y, x, d, window = False):
+        '''Labyrinth.open_wall on the current maze, also patching the two cells
+        in the observation buffer and dropping the cached maze render layer'''
+        self.field.open_wall(y, x, d, window)
+        dy, dx = _steps[d]
+        for cy, cx in ((y, x), (y + dy, x + dx)):
+            py, px = self._pad + cy, self._pad + cx
+            if self.obs_encoding == 'packed':
+                cells = pack_field(self.field.field[:, cy:cy+1, cx:cx+1]).item()
+                self._obs[py, px] = (self._obs[py, px].item() & ~0xff) | cells
+            else:
+                self._obs[py, px, 0:8] = self.field.field[:, cy, cx]
+        self._maze_layer = None
+    
+    def get_state(self):
+        '''Snapshot of the game; the maze is shared by reference, not copied'''
+        return EnvState(
+            self.field, tuple(map(tuple, self.hiders.tolist())), tuple(map(tuple, self.seekers.tolist())), self.steps, self._rng_state()
+        )
+    
+    def set_state(self, state):
+        '''Restore a snapshot taken by get_state'''
+        self._cancel_prefetch()
+        if state.maze is not self.field:
+            self.field = state.maze
+            self.h, self.w = state.maze.h, state.maze.w
+            self._write_maze()
+        self._place(state.hider, state.seeker)
+        self.steps = state.steps
+        self._set_rng_state(state.rng)
+    
+    def simulate(self, states, action_sequences):
+        '''Roll many snapshots forward at once with the batched env logic.
+        
+        action_sequences holds one row of T actions per state. Returns the
+        [B, T] rewards and dones (zero and True after a branch has ended)
+        and the final states as a new list; this env and states are left untouched.
+        '''
+        assert self._vec_class is not None, '{} cannot be simulated'.format(type(self).__name__)
+        assert self.n_hiders == 1, 'simulate supports a single hider'
+        states = list(states) # the final states replace their roots in this copy
+        mazes = {id(s.maze): s.maze for s in states}
+        if len(mazes) == 1:
+            field = np.broadcast_to(states[0].maze.field, (len(states),) + states[0].maze.field.shape)
+        else:
+            field = np.stack([s.maze.field for s in states])
+        vec = self._vec_class.from_games(field, [s.hider for s in states], [s.seeker for s in states], [s.steps for s in states])
+        
+        action_sequences = np.asarray(action_sequences)
+        rewards = np.zeros(action_sequences.shape[:2], dtype=np.int64)
+        dones = np.ones(action_sequences.shape[:2], dtype=bool)
+        alive = np.ones(len(states), dtype=bool)
+        for t in range(action_sequences.shape[1]):
+            reward, done = vec.advance(action_sequences[:, t])
+            rewards[alive, t] = reward[alive]
+            dones[alive, t] = done[alive]
+            # finished branches are frozen at their final state
+            final = alive & done
+            alive &= ~done
+            if final.any():
+                for i in np.flatnonzero(final):
+                    states[i] = self._branch_state(states[i], vec, i)
+            if not alive.any():
+                break
+        states = [self._branch_state(s, vec, i) if alive[i] else s for i, s in enumerate(states)]
+        return rewards, dones, states
+    
+    @staticmethod
+    def _branch_state(state, vec, i):
+        return state._replace(
+            hider=(tuple(int(v) for v in vec.hider[i]),),
+            seeker=tuple(tuple(int(v) for v in s) for s in vec.seeker[i]),
+            steps=int(vec.steps[i])
+        )
+    
+    def _ai_moves(self, pos, dist, windows, nearer):
+        '''Scripted step of every agent at pos: the first direction that strictly
+        lowers (nearer) or raises dist, or 4 to stay, for _shift'''
+        if len(pos) <= self.loop_agents:
+            return self._ai_moves_loop(pos, dist, windows, nearer)
+        w = self.field.w
+        flat = pos[:, 0] * w + pos[:, 1]
+        cell = self.field.field.reshape(8, -1)[:, flat]
+        moves = cell[0:4] == 0
+        if windows:
+            moves |= cell[4:8] == 1
+        dist = dist.ravel()
+        here = dist[flat]
+        # off-grid neighbours are clipped to some cell; the border walls mask them anyway
+        offset = self.direction[:4, 0:1] * w + self.direction[:4, 1:2]
+        ndist = np.take(dist, flat + offset, mode='clip').astype(np.int64)
+        agents = np.arange(len(pos))
+        if nearer:
+            ndist[~moves] = np.iinfo(np.int64).max
+            best = ndist.argmin(axis=0)
+            step = ndist[best, agents] < here
+        else:
+            ndist[~moves] = -1
+            best = ndist.argmax(axis=0)
+            step = ndist[best, agents] > here
+        return np.where(step, best, 4)
+    
+    def _ai_moves_loop(self, pos, dist, windows, nearer):
+        field = self.field.field
+        best = [4] * len(pos)
+        for i, (y, x) in enumerate(pos.tolist()):
+            # plain ints, as numpy scalar reads and compares dominate here
+            cell = field[:, y, x].tolist()
+            mdist = dist.item(y, x)
+            for d in range(4):
+                if cell[d] == 0 or windows and cell[d+4] == 1:
+                    dy, dx = _steps[d]
+                    ndist = dist.item(y+dy, x+dx)
+                    if ndist < mdist if nearer else ndist > mdist:
+                        mdist = ndist
+                        best[i] = d
+        return best
+    
+    def _nearest_distance(self, pos):
+        if len(pos) == 1:
+            return self.field.distance(*pos[0].tolist())
+        if len(pos) <= self.ai_distance_rows:
+            return self.field.nearest_distance(pos)
+        return self.field.nearest_distance(pos, rows=False)
+    
     def seeker_ai(self):
-        from queue import Queue
-        q = Queue()
-        q.put(self.hider)
-        dist = np.full([self.h, self.w], self.h*self.w+1, dtype=np.int32)
-        dist[self.hider[0], self.hider[1]] = 0
-        while not q.empty() > 0:
-            p = q.get()
-            d = dist[p[0], p[1]]
-            for i in range(4):
-                if self.field.field[i, p[0], p[1]] == 0:
-                    newp = [p[0]+self.direction[i][0], p[1]+self.direction[i][1]]
-                    if dist[newp[0], newp[1]] > d+1:
-                        dist[newp[0], newp[1]] = d+1
-                        q.put(newp)
-                        
-        for s in self.seeker:
-            mdist = dist[s[0], s[1]]
-            mdir = 4
-            for i in range(4):
-                if self.field.field[i, s[0], s[1]] == 0:
-                    newp = [s[0]+self.direction[i][0], s[1]+self.direction[i][1]]
-                    if dist[newp[0], newp[1]] < mdist:
-                        mdist = dist[newp[0], newp[1]]
-                        mdir = i
-            s[0] += self.direction[mdir][0]
-            s[1] += self.direction[mdir][1]
+        '''Every seeker steps towards the nearest hider, twice on odd steps'''
+        dist = self._nearest_distance(self.hiders)
+        self._shift(1, self._ai_moves(self.seekers, dist, False, True))
         if self.steps % 2:
-            for s in self.seeker:
-                mdist = dist[s[0], s[1]]
-                mdir = 4
-                for i in range(4):
-                    if self.field.field[i, s[0], s[1]] == 0:
-                        newp = [s[0]+self.direction[i][0], s[1]+self.direction[i][1]]
-                        if dist[newp[0], newp[1]] < mdist:
-                            mdist = dist[newp[0], newp[1]]
-                            mdir = i
-                s[0] += self.direction[mdir][0]
-                s[1] += self.direction[mdir][1]
+            self._shift(1, self._ai_moves(self.seekers, dist, False, True))
     
     def hider_ai(self):
-        from queue import Queue
-        dist = np.full([self.h, self.w], self.h*self.w+1, dtype=np.int32)
-        for s in self.seeker:
-            q = Queue()
-            q.put(s)
-            dist[s[0], s[1]] = 0
-            while not q.empty() > 0:
-                p = q.get()
-                d = dist[p[0], p[1]]
-                for i in range(4):
-                    if self.field.field[i, p[0], p[1]] == 0:
-                        newp = [p[0]+self.direction[i][0], p[1]+self.direction[i][1]]
-                        if dist[newp[0], newp[1]] > d+1:
-                            dist[newp[0], newp[1]] = d+1
-                            q.put(newp)
+        '''Every hider steps away from the nearest seeker, through windows too'''
+        dist = self._nearest_distance(self.seekers)
+        self._shift(0, self._ai_moves(self.hiders, dist, True, False))
+    
+    def _observation_space(self, h, w, n_controlled = None):
+        '''Observation space for the configured encoding.
         
-        mdist = dist[self.hider[0], self.hider[1]]
-        mdir = 4
-        for i in range(4):
-            if self.field.field[i, self.hider[0], self.hider[1]] == 0 or self.field.field[i+4, self.hider[0], self.hider[1]] == 1:
-                newp = [self.hider[0]+self.direction[i][0], self.hider[1]+self.direction[i][1]]
-                if dist[newp[0], newp[1]] > mdist:
-                    mdist = dist[newp[0], newp[1]]
-                    mdir = i
-        self.hider[0] += self.direction[mdir][0]
-        self.hider[1] += self.direction[mdir][1]
+        float32/uint8 give [h, w, 10] binary channels. 'packed' gives one
+        uint16 code per cell ([h, w]), bit c being channel c. With obs_crop=k
+        the observation is a k x k window centred on each controlled agent,
+        stacked along the last axis; cells outside the maze read as solid.
+        partial_obs adds channel 10, the cells in sight.
+        '''
+        n_controlled = self.n_controlled if n_controlled is None else n_controlled
+        shape = [h, w] if self.obs_crop is None else [self.obs_crop, self.obs_crop]
+        if self.obs_encoding == 'packed':
+            if self.obs_crop is not None and n_controlled > 1:
+                shape.append(n_controlled)
+            return spaces.Box(low=0, high=(1 << self._channels) - 1, shape=shape, dtype=np.uint16)
+        channels = self._channels if self.obs_crop is None else self._channels * n_controlled
+        return spaces.Box(low=0, high=1, shape=shape + [channels], dtype=np.dtype(self.obs_encoding))
+    
+    def _hider_action_space(self):
+        # a single hider keeps the plain Discrete(5) action
+        return spaces.Discrete(5) if self.n_hiders == 1 else spaces.MultiDiscrete([5] * self.n_hiders)
+    
+    def _seeker_action_space(self):
+        return spaces.MultiDiscrete([5] * self.n_seekers)
+    
+    def controlled_agents(self):
+        '''Positions of the agents this env is played from'''
+        return self.hiders
+    
+    def _draw_agents(self):
+        '''Refresh channels 8 (hiders) and 9 (seekers) of the cells agents left or entered'''
+        if not self._dirty:
+            return
+        if len(self._dirty) <= 4 * self.loop_agents:
+            self._draw_cells(self._dirty)
+            self._dirty = set()
+            return
+        cells = np.array(list(self._dirty))
+        self._dirty = set()
+        # both channels of each cell, so repeated cells write the same value
+        y, x = cells[:, 1], cells[:, 2]
+        occupied = self._occupancy[:, y, x] > 0
+        y = y + self._pad
+        x = x + self._pad
+        if self.obs_encoding == 'packed':
+            self._obs[y, x] = (self._obs[y, x] & 0xFF) | (occupied[0] << 8) | (occupied[1] << 9)
+        else:
+            self._obs[y, x, 8] = occupied[0]
+            self._obs[y, x, 9] = occupied[1]
+    
+    def _draw_cells(self, cells):
+        occ, obs, pad = self._occupancy, self._obs, self._pad
+        if self.obs_encoding == 'packed':
+            for side, y, x in cells:
+                bit = 1 << (8 + side)
+                obs[y+pad, x+pad] = obs.item(y+pad, x+pad) & ~bit | (bit if occ.item(side, y, x) else 0)
+        else:
+            for side, y, x in cells:
+                obs[y+pad, x+pad, 8+side] = occ.item(side, y, x) > 0
+    
+    def _observe(self, agents):
+        '''Observation of the drawn buffer as seen from agents (which only matters with obs_crop or partial_obs)'''
+        if self.partial_obs:
+            return self._observe_partial(agents)
+        if self.obs_crop is not None:
+            k = self.obs_crop
+            crops = [self._obs[y:y+k, x:x+k] for y, x in agents]
+            if len(crops) == 1:
+                return crops[0].copy()
+            return np.stack(crops, axis=-1) if self.obs_encoding == 'packed' else np.concatenate(crops, axis=-1)
+        return self._obs.copy() if self.copy_obs else self._obs_view
+    
+    def _observe_partial(self, agents):
+        '''Observation restricted to the line of sight of agents.
+        
+        Cells out of sight read as all zeros, channel 10 marks the cells in
+        sight, and the solid border and padding stay as they are. A full
+        observation shows what any of the agents sees; a crop shows what
+        its own agent sees.
+        '''
+        visibility = self.field.visibility(self.view_radius)
+        if self.obs_crop is None:
+            return self._mask(self._obs, *self._sight(visibility.visible(agents)))
+        k = self.obs_crop
+        crops = []
+        for y, x in agents:
+            window = (slice(y, y+k), slice(x, x+k))
+            seen, keep = self._sight(visibility.visible([(y, x)]))
+            crops.append(self._mask(self._obs[window], seen[window], keep[window]))
+        if len(crops) == 1:
+            return crops[0]
+        return np.stack(crops, axis=-1) if self.obs_encoding == 'packed' else np.concatenate(crops, axis=-1)
+    
+    def _sight(self, visible):
+        '''Buffer-sized masks of the cells in sight and of those left unblanked
+        (in sight or outside the maze), from the [h, w] visible mask'''
+        inner = (slice(self._pad, self._pad + self.h), slice(self._pad, self._pad + self.w))
+        seen = np.zeros(self._obs.shape[:2], dtype=bool)
+        seen[inner] = visible
+        keep = np.ones(self._obs.shape[:2], dtype=bool)
+        keep[inner] = visible
+        return seen, keep
+    
+    def _mask(self, region, seen, keep):
+        '''Copy of a buffer region with the cells not in keep blanked and seen appended as channel 10'''
+        if self.obs_encoding == 'packed':
+            return np.where(keep, region, 0).astype(np.uint16) | (seen.astype(np.uint16) << 10)
+        out = np.empty(region.shape[:2] + (11,), dtype=region.dtype)
+        np.multiply(region, keep[..., None], out=out[..., :10])
+        out[..., 10] = seen
+        return out
     
     @property
     def state(self):
-        s = np.zeros([10, self.h, self.w], dtype=np.float32)
-        s[0:8] = self.field.field.astype(np.float32)
-        s[8, self.hider[0], self.hider[1]] = 1
-        for seeker in self.seeker:
-            s[9, seeker[0], seeker[1]] = 1
-        return s.transpose([1, 2, 0])
-    
-    def render(self, mode="human"):
-        block_width = 30
-        wall_width = 3
-        width = block_width * self.w
-        height = block_width * self.h
+        '''The observation; a read-only view of the shared buffer unless copy_obs, obs_crop or partial_obs'''
+        self._draw_agents()
+        return self._observe(self.controlled_agents())
+    
+    def _legal_moves(self, pos, action, windows):
+        '''action with the moves blocked by a wall (or, without windows, a window) replaced by 4'''
+        field = self.field.field
+        if len(pos) <= self.loop_agents:
+            action = [action] if isinstance(action, (int, np.integer)) else np.ravel(action).tolist()
+            moves = []
+            for a, (y, x) in zip(action, pos.tolist()):
+                legal = a != 4 and (field.item(a, y, x) == 0 or windows and field.item(a+4, y, x) == 1)
+                moves.append(a if legal else 4)
+            return moves
+        action = np.asarray(action, dtype=np.int64).reshape(len(pos))
+        d = np.minimum(action, 3)
+        y, x = pos[:, 0], pos[:, 1]
+        legal = field[d, y, x] == 0
+        if windows:
+            legal |= field[d + 4, y, x] == 1
+        return np.where(legal & (action != 4), action, 4)
+    
+    def move_hider(self, action):
+        '''Move each hider one cell, through open cells and windows'''
+        self._shift(0, self._legal_moves(self.hiders, action, True))
+    
+    def move_seekers(self, action):
+        '''Move each seeker one cell, through open cells only'''
+        self._shift(1, self._legal_moves(self.seekers, action, False))
+    
+    def check_catch(self):
+        '''Whether a seeker stands on any hider's cell; one occupancy lookup per hider'''
+        if self.n_hiders <= self.loop_agents:
+            occ = self._occupancy[1]
+            return any(occ[y, x] for y, x in self.hiders.tolist())
+        return bool(self._occupancy[1, self.hiders[:, 0], self.hiders[:, 1]].any())
+    
+    def render(self, mode=None):
+        '''Rasterize the game with NumPy; "human" shows the frame, "rgb_array" returns it'''
+        mode = self.render_mode if mode is None else mode
+        if self._maze_layer is None:
+            self._maze_layer = raster.maze_layer(self.field.field)
+        image = raster.render(self.field.field, self.hiders, self.seekers, self._maze_layer)
+        if mode == 'rgb_array':
+            return image
         if self.viewer is None:
             from gym.envs.classic_control import rendering
-            self.viewer = rendering.Viewer(width, height)
-            for i in range(self.h):
-                for j in range(self.w):
-                    if self.field.field[0, i, j]:
-                        edge = rendering.FilledPolygon([
-                            (block_width*j, block_width*(self.h-i)),
-                            (block_width*j, block_width*(self.h-i)-wall_width),
-                            (block_width*(j+1), block_width*(self.h-i)-wall_width),
-                            (block_width*(j+1), block_width*(self.h-i))
-                        ])
-                        edge.set_color(0, 0, 0)
-                        self.viewer.add_geom(edge)
-                    if self.field.field[1, i, j]:
-                        edge = rendering.FilledPolygon([
-                            (block_width*j, block_width*(self.h-1-i)),
-                            (block_width*j, block_width*(self.h-1-i)+wall_width),
-                            (block_width*(j+1), block_width*(self.h-1-i)+wall_width),
-                            (block_width*(j+1), block_width*(self.h-1-i))
-                        ])
-                        edge.set_color(0, 0, 0)
-                        self.viewer.add_geom(edge)
-                    if self.field.field[2, i, j]:
-                        edge = rendering.FilledPolygon([
-                            (block_width*j, block_width*(self.h-i)),
-                            (block_width*j, block_width*(self.h-1-i)),
-                            (block_width*j+wall_width, block_width*(self.h-1-i)),
-                            (block_width*j+wall_width, block_width*(self.h-i))
-                        ])
-                        edge.set_color(0, 0, 0)
-                        self.viewer.add_geom(edge)
-                    if self.field.field[3, i, j]:
-                        edge = rendering.FilledPolygon([
-                            (block_width*(j+1), block_width*(self.h-i)),
-                            (block_width*(j+1), block_width*(self.h-1-i)),
-                            (block_width*(j+1)-wall_width, block_width*(self.h-1-i)),
-                            (block_width*(j+1)-wall_width, block_width*(self.h-i))
-                        ])
-                        edge.set_color(0, 0, 0)
-                        self.viewer.add_geom(edge)
-            for i in range(self.h):
-                for j in range(self.w):
-                    if self.field.field[4, i, j]:
-                        edge = rendering.FilledPolygon([
-                            (block_width*j, block_width*(self.h-i)),
-                            (block_width*j, block_width*(self.h-i)-wall_width),
-                            (block_width*(j+1), block_width*(self.h-i)-wall_width),
-                            (block_width*(j+1), block_width*(self.h-i))
-                        ])
-                        edge.set_color(0, 1, 0)
-                        self.viewer.add_geom(edge)
-                    if self.field.field[5, i, j]:
-                        edge = rendering.FilledPolygon([
-                            (block_width*j, block_width*(self.h-1-i)),
-                            (block_width*j, block_width*(self.h-1-i)+wall_width),
-                            (block_width*(j+1), block_width*(self.h-1-i)+wall_width),
-                            (block_width*(j+1), block_width*(self.h-1-i))
-                        ])
-                        edge.set_color(0, 1, 0)
-                        self.viewer.add_geom(edge)
-                    if self.field.field[6, i, j]:
-                        edge = rendering.FilledPolygon([
-                            (block_width*j, block_width*(self.h-i)),
-                            (block_width*j, block_width*(self.h-1-i)),
-                            (block_width*j+wall_width, block_width*(self.h-1-i)),
-                            (block_width*j+wall_width, block_width*(self.h-i))
-                        ])
-                        edge.set_color(0, 1, 0)
-                        self.viewer.add_geom(edge)
-                    if self.field.field[7, i, j]:
-                        edge = rendering.FilledPolygon([
-                            (block_width*(j+1), block_width*(self.h-i)),
-                            (block_width*(j+1), block_width*(self.h-1-i)),
-                            (block_width*(j+1)-wall_width, block_width*(self.h-1-i)),
-                            (block_width*(j+1)-wall_width, block_width*(self.h-i))
-                        ])
-                        edge.set_color(0, 1, 0)
-                        self.viewer.add_geom(edge)
-        self.viewer.draw_polygon(
-            v=[
-                (block_width*self.hider[1]+10, block_width*(self.h-1-self.hider[0])+10),
-                (block_width*self.hider[1]+10, block_width*(self.h-1-self.hider[0])+20),
-                (block_width*self.hider[1]+20, block_width*(self.h-1-self.hider[0])+20),
-                (block_width*self.hider[1]+20, block_width*(self.h-1-self.hider[0])+10),
-            ],
-            color = (0, 0, 1)
-        )
-        for seeker in self.seeker:
-            self.viewer.draw_polygon(
-                v=[
-                    (block_width*seeker[1]+10, block_width*(self.h-1-seeker[0])+10),
-                    (block_width*seeker[1]+10, block_width*(self.h-1-seeker[0])+20),
-                    (block_width*seeker[1]+20, block_width*(self.h-1-seeker[0])+20),
-                    (block_width*seeker[1]+20, block_width*(self.h-1-seeker[0])+10),
-                ],
-                color = (1, 0, 0)
-            )
-        return self.viewer.render(return_rgb_array=mode=="rgb_array")
+            self.viewer = rendering.SimpleImageViewer()
+        self.viewer.imshow(image)
+        return self.viewer.isopen
+    
+    def close(self):
+        if self.viewer:
+            self.viewer.close()
+            self.viewer = None
+        self._cancel_prefetch()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._own_service:
+            self.maze_service.close()
+            self._own_service = False
 
 
 class Hider(Hide_Seek):
-    def __init__(self, h = 10, w = 15, connectivity = 0, window_ratio = .1) -> None:
-        super().__init__(h, w, connectivity, window_ratio)
-        self.action_space = spaces.Discrete(5) # U D L R NOP
+    _vec_class = VecHider
+    
+    def __init__(self, h = 10, w = 15, connectivity = 0, window_ratio = .1, **kwargs) -> None:
+        super().__init__(h, w, connectivity, window_ratio, **kwargs)
+        self.action_space = self._hider_action_space() # U D L R NOP
 
     def step(self, action):
-        err_msg = "%r (%s) invalid" % (action, type(action))
-        assert self.action_space.contains(action), err_msg
+        assert self.action_space.contains(action), "%r (%s) invalid" % (action, type(action))
         
-        if action != 4 and \
-            (self.field.field[action, self.hider[0], self.hider[1]] == 0 or \
-                self.field.field[action+4, self.hider[0], self.hider[1]] == 1
-            ):
-            self.hider[0] += self.direction[action][0]
-            self.hider[1] += self.direction[action][1]
+        self.move_hider(action)
         
         self.seeker_ai()
         
@@ -260,29 +701,31 @@ class Hider(Hide_Seek):
         self.steps += 1
         done = self.steps > 1000
         
-        for s in self.seeker:
-            if s == self.hider:
-                reward = -1
-                done = True
+        if self.check_catch():
+            reward = -1
+            done = True
         
-        info = {}
+        state = self.state
+        info = self._info()
         
-        return self.state, reward, done, info
+        return state, reward, done, info
 
 
 class Seeker(Hide_Seek):
-    def __init__(self, h = 10, w = 15, connectivity = 0, window_ratio = .1) -> None:
-        super().__init__(h, w, connectivity, window_ratio)
-        self.action_space = spaces.MultiDiscrete([5, 5]) # U D L R NOP
+    _vec_class = VecSeeker
+    controls = 'seeker'
+    
+    def __init__(self, h = 10, w = 15, connectivity = 0, window_ratio = .1, **kwargs) -> None:
+        super().__init__(h, w, connectivity, window_ratio, **kwargs)
+        self.action_space = self._seeker_action_space() # U D L R NOP
+    
+    def controlled_agents(self):
+        return self.seekers
 
     def step(self, action):
-        err_msg = "%r (%s) invalid" % (action, type(action))
-        assert self.action_space.contains(action), err_msg
+        assert self.action_space.contains(action), "%r (%s) invalid" % (action, type(action))
         
-        for i, act in enumerate(action):
-            if act != 4 and self.field.field[act, self.seeker[i][0], self.seeker[i][1]] == 0:
-                self.seeker[i][0] += self.direction[act][0]
-                self.seeker[i][1] += self.direction[act][1]
+        self.move_seekers(action)
             
         if self.steps % 2 == 0:
             self.hider_ai()
@@ -291,12 +734,12 @@ class Seeker(Hide_Seek):
         self.steps += 1
         done = self.steps > 2000
         
-        for s in self.seeker:
-            if s == self.hider:
-                reward = 1
-                done = True
+        if self.check_catch():
+            reward = 1
+            done = True
         
-        info = {}
+        state = self.state
+        info = self._info()
         
-        return self.state, reward, done, info
+        return state, reward, done, info
             
\ No newline at end of file
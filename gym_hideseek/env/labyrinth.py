@@ -2,108 +2,304 @@ import numpy as np
 import random
 import typing
 
-from gym_hideseek.env.dsu import DSU
+from gym_hideseek.env import pathing
+from gym_hideseek.env.maze_index import MazeIndex
+from gym_hideseek.env.visibility import VisibilityIndex
+
+
+def _walls(h, w):
+    '''Flat cell pairs of every inner wall, horizontal neighbours first, then vertical ones column by column'''
+    cell = np.arange(h*w).reshape(h, w)
+    u = np.concatenate([cell[:, :-1].ravel(), cell[:-1, :].T.ravel()])
+    v = np.concatenate([cell[:, 1:].ravel(), cell[1:, :].T.ravel()])
+    return u, v
+
+
+def _spanning_forest(u, v, order, n_nodes) -> np.ndarray:
+    '''Mask of the edges Kruskal would keep when scanning them in the given order.
+
+    With distinct priorities the minimum spanning forest is unique, so it is
+    computed with Borůvka rounds instead: every component picks its first
+    outgoing edge, the picks are merged by pointer jumping, and the number of
+    components at least halves per round. No union-find recursion is involved.
+    '''
+    comp = np.arange(n_nodes)
+    selected = np.zeros(len(u), dtype=bool)
+    idx = np.asarray(order)
+    while True:
+        cu = comp[u[idx]]
+        cv = comp[v[idx]]
+        keep = cu != cv
+        idx, cu, cv = idx[keep], cu[keep], cv[keep]
+        if not idx.size:
+            return selected
+        best = np.full(n_nodes, idx.size)
+        pos = np.arange(idx.size)
+        np.minimum.at(best, cu, pos)
+        np.minimum.at(best, cv, pos)
+        roots = np.flatnonzero(best < idx.size)
+        e = best[roots]
+        selected[idx[e]] = True
+        other = np.where(cu[e] == roots, cv[e], cu[e])
+        ptr = np.arange(n_nodes)
+        ptr[roots] = other
+        mutual = (ptr[other] == roots) & (roots < other) # both ends picked the same edge
+        ptr[roots[mutual]] = roots[mutual]
+        while True:
+            nxt = ptr[ptr]
+            if (nxt == ptr).all():
+                break
+            ptr = nxt
+        comp = ptr[comp]
+
+
+def _uniform(rand, size) -> np.ndarray:
+    if isinstance(rand, (np.random.RandomState, np.random.Generator)):
+        return rand.random(size)
+    return np.array([rand.random() for _ in range(size)])
+
 
 class Labyrinth:
     __wallu = 0
     __walld = 1
     __walll = 2
     __wallr = 3
+    # the cached distance rows of a maze are kept within this many bytes
+    # (but at least min_dist_rows rows), least recently used first out
+    dist_cache_bytes = 4 << 20
+    min_dist_rows = 8
         
     def generate(self, h, w, connectivity = .3, window_ratio = .1, rand = random) -> None:
+        self.load(self.generate_batch(1, h, w, connectivity, window_ratio, rand)[0])
+    
+    def load(self, field, distance_table = None) -> None:
+        '''Use an existing [8, h, w] field, and optionally its distance table, as the maze'''
+        self.h, self.w = field.shape[1:]
+        self.field = field
+        self._dist = {}
+        self._dist_table = distance_table
+        self._passable = None
+        self._index = None
+        self._visibility = {}
+    
+    @property
+    def index(self) -> MazeIndex:
+        '''The MazeIndex of this maze, built on first use'''
+        if self._index is None:
+            self._index = MazeIndex(self)
+        return self._index
+    
+    def visibility(self, radius = None) -> VisibilityIndex:
+        '''The VisibilityIndex of this maze for a view radius, built on first use'''
+        if radius not in self._visibility:
+            self._visibility[radius] = VisibilityIndex(self, radius)
+        return self._visibility[radius]
+    
+    @classmethod
+    def generate_batch(cls, k, h, w, connectivity = .3, window_ratio = .1, rand = random) -> np.ndarray:
+        '''Generate k mazes at once as a [k, 8, h, w] field array.
+        
+        rand is consumed exactly as k successive generate() calls would, so
+        maze i of the batch is the maze the i-th call would have produced.
+        connectivity is the fraction of the walls left by both spanning trees
+        that is opened as loops, and window_ratio the share of the hider's
+        tree passages and of those loops that become windows; both are
+        independent fractions in [0, 1].
+        '''
         assert h >= 2 and w >= 2
-        assert connectivity >= 0. and window_ratio >= 0. and connectivity + window_ratio <= 1.
-        self.h = h
-        self.w = w
-        self.field = np.ones([8, h, w], dtype=np.int32)
-        self.field[4:] = 0
+        assert 0. <= connectivity <= 1. and 0. <= window_ratio <= 1.
+        n = h * w
+        u, v = _walls(h, w)
+        m = len(u)
         
-        walls_h = []
-        walls_s = []
-        rest_walls_s = []
-        rest_walls_h = []
-        for i in range(h):
-            for j in range(w-1):
-                walls_h.append([i*w + j, i*w + j+1])
-                walls_s.append([i*w + j, i*w + j+1])
-        for i in range(w):
-            for j in range(h-1):
-                walls_h.append([j*w + i, (j+1)*w + i])
-                walls_s.append([j*w + i, (j+1)*w + i])
+        rank_s = np.empty([k, m], dtype=np.int64)
+        rank_h = np.empty([k, m], dtype=np.int64)
+        draws = np.empty([k, n-1])
+        if connectivity > 0:
+            loop_keys = np.empty([k, m])
+            loop_draws = np.empty([k, m])
+        for i in range(k):
+            perm_s = np.arange(m)
+            perm_h = np.arange(m)
+            rand.shuffle(perm_s)
+            rand.shuffle(perm_h)
+            rank_s[i, perm_s] = np.arange(m)
+            rank_h[i, perm_h] = np.arange(m)
+            draws[i] = _uniform(rand, n-1)
+            if connectivity > 0: # drawn per maze as well, so batches still match generate()
+                loop_keys[i] = _uniform(rand, m)
+                loop_draws[i] = _uniform(rand, m)
         
-        s_s = DSU(h*w)
-        s_h = DSU(h*w)
-        rand.shuffle(walls_s)
-        rand.shuffle(walls_h)
+        base = (np.arange(k) * n)[:, None]
+        gu = (base + u).ravel()
+        gv = (base + v).ravel()
         
-        for wall in walls_h:
-            w1 = wall[0]
-            w2 = wall[1]
-            p1 = s_h.find(w1)
-            p2 = s_h.find(w2)
-            if p1 != p2:
-                if rand.random() < window_ratio:
-                    if w2 - w1 == 1:
-                        self.field[self.__wallr+4, w1 // w, w1 % w] = 1
-                        self.field[self.__walll+4, w2 // w, w2 % w] = 1
-                    else:
-                        self.field[self.__walld+4, w1 // w, w1 % w] = 1
-                        self.field[self.__wallu+4, w2 // w, w2 % w] = 1
-                else:
-                    if w2 - w1 == 1:
-                        self.field[self.__wallr, w1 // w, w1 % w] = 0
-                        self.field[self.__walll, w2 // w, w2 % w] = 0
-                    else:
-                        self.field[self.__walld, w1 // w, w1 % w] = 0
-                        self.field[self.__wallu, w2 // w, w2 % w] = 0
-                s_h.add(p1, p2)
-            else:
-                rest_walls_h.append(wall)
-                
-        for wall in walls_s:
-            w1 = wall[0]
-            w2 = wall[1]
-            p1 = s_s.find(w1)
-            p2 = s_s.find(w2)
-            if p1 != p2:
-                if w2 - w1 == 1:
-                    if self.field[self.__wallr+4, w1 // w, w1 % w] == 1:
-                        continue
-                    self.field[self.__wallr, w1 // w, w1 % w] = 0
-                    self.field[self.__walll, w2 // w, w2 % w] = 0
-                else:
-                    if self.field[self.__walld+4, w1 // w, w1 % w] == 1:
-                        continue
-                    self.field[self.__walld, w1 // w, w1 % w] = 0
-                    self.field[self.__wallu, w2 // w, w2 % w] = 0
-                s_s.add(p1, p2)
-            else:
-                rest_walls_s.append(wall)
+        # the hider's maze: a spanning tree in which some passages are windows
+        tree_h = _spanning_forest(gu, gv, np.argsort(rank_h, axis=None, kind='stable'), k*n)
+        accepted = np.flatnonzero(tree_h)
+        accepted = accepted[np.lexsort((rank_h.ravel()[accepted], accepted // m))]
+        windows = np.zeros(k*m, dtype=bool)
+        windows[accepted[draws.ravel() < window_ratio]] = True
+        
+        # the seekers' maze: a spanning forest that avoids the windows
+        order_s = np.argsort(rank_s, axis=None, kind='stable')
+        tree_s = _spanning_forest(gu, gv, order_s[~windows[order_s]], k*n)
+        
+        passages = (tree_h & ~windows) | tree_s
         
-        # n_del_wall = int(connectivity * len(rest_walls))
-        # n_window = int(window_ratio * len(rest_walls))
-        # rand.shuffle(rest_walls)
-        # for i in range(n_del_wall):
-        #     wall = rest_walls[i]
-        #     w1 = wall[0]
-        #     w2 = wall[1]
-        #     if w2 - w1 == 1:
-        #         self.field[self.__wallr, w1 // w, w1 % w] = 0
-        #         self.field[self.__walll, w2 // w, w2 % w] = 0
-        #     else:
-        #         self.field[self.__walld, w1 // w, w1 % w] = 0
-        #         self.field[self.__wallu, w2 // w, w2 % w] = 0
+        # loops: a connectivity fraction of the walls left closed by both trees,
+        # picked uniformly per maze, is opened (a window_ratio share of them
+        # becomes windows instead). One argsort per batch, whatever the fraction.
+        if connectivity > 0:
+            rest = ~(tree_h | tree_s).reshape(k, m)
+            order = np.argsort(np.where(rest, loop_keys, 2.), axis=1, kind='stable')
+            rank = np.empty_like(order)
+            np.put_along_axis(rank, order, np.broadcast_to(np.arange(m), (k, m)), axis=1)
+            loops = rest & (rank < (connectivity * rest.sum(axis=1)).astype(np.int64)[:, None])
+            loop_windows = loops & (loop_draws < window_ratio)
+            passages |= (loops & ~loop_windows).ravel()
+            windows |= loop_windows.ravel()
+        
+        horizontal = np.arange(m) < h*(w-1)
+        dir_u = np.where(horizontal, cls.__wallr, cls.__walld)
+        dir_v = np.where(horizontal, cls.__walll, cls.__wallu)
+        field = np.ones([k, 8, n], dtype=np.int32)
+        field[:, 4:] = 0
+        for mask, value, shift in ((passages, 0, 0), (windows, 1, 4)):
+            maze, j = np.divmod(np.flatnonzero(mask), m)
+            field[maze, dir_u[j] + shift, u[j]] = value
+            field[maze, dir_v[j] + shift, v[j]] = value
+        return field.reshape(k, 8, h, w)
+    
+    def open_wall(self, y, x, d, window = False) -> None:
+        '''Remove the wall on side d (U D L R) of cell (y, x), or turn it into a window.
+        
+        Distances already computed for the maze, the loaded table as well as
+        the cached rows, are updated in place for the new passage instead of
+        being recomputed. A window leaves them untouched, since seekers
+        cannot pass it. The field is modified in place, so every holder of
+        this Labyrinth (e.g. an EnvState) sees the change; an env's
+        observation buffer and render layer are only updated when the wall
+        is opened through Hide_Seek.open_wall.
+        '''
+        dy, dx = pathing.offset_dirs[d]
+        y2, x2 = y + dy, x + dx
+        assert 0 <= y2 < self.h and 0 <= x2 < self.w, 'cannot open the outer wall'
+        if self.field[d, y, x] == 0:
+            return
+        opposite = d ^ 1
+        self._index = None
+        self._visibility = {}
+        if window:
+            self.field[d + 4, y, x] = self.field[opposite + 4, y2, x2] = 1
+            return
+        a, b = y * self.w + x, y2 * self.w + x2
+        if self._dist_table is not None or self._dist:
+            row_a = self.distance(y, x).ravel().copy()
+            row_b = self.distance(y2, x2).ravel().copy()
+        self.field[d, y, x] = self.field[opposite, y2, x2] = 0
+        self.field[d + 4, y, x] = self.field[opposite + 4, y2, x2] = 0
+        self._passable = None
+        if self._dist_table is not None:
+            if not self._dist_table.flags.writeable: # e.g. a memory-mapped MazeBank table
+                self._dist_table = np.array(self._dist_table)
+            self._join(self._dist_table, row_a, row_b, a, b)
+        if self._dist:
+            sources = list(self._dist)
+            rows = np.stack([self._dist[src] for src in sources])
+            self._join(rows, row_a, row_b, a, b)
+            self._dist = dict(zip(sources, rows))
+    
+    @staticmethod
+    def _join(rows, row_a, row_b, a, b, chunk = 1 << 20) -> None:
+        '''Update distance rows in place for a new unit edge between cells a and b.
         
-        # for i in range(n_del_wall, n_del_wall + n_window):
-        #     wall = rest_walls[i]
-        #     w1 = wall[0]
-        #     w2 = wall[1]
-        #     if w2 - w1 == 1:
-        #         self.field[self.__wallr+4, w1 // w, w1 % w] = 1
-        #         self.field[self.__walll+4, w2 // w, w2 % w] = 1
-        #     else:
-        #         self.field[self.__walld+4, w1 // w, w1 % w] = 1
-        #         self.field[self.__wallu+4, w2 // w, w2 % w] = 1
+        A path through the new edge is d(s, a) + 1 + d(b, t) or the other way
+        round, so only the rows whose distances to a and b differ by more
+        than one can change. row_a/row_b are the distances from a and b
+        before the edge was added.
+        '''
+        ra = rows[:, a].astype(np.int64)
+        rb = rows[:, b].astype(np.int64)
+        changed = np.flatnonzero(np.abs(ra - rb) > 1)
+        row_a = row_a.astype(np.int64)
+        row_b = row_b.astype(np.int64)
+        step = max(1, chunk // rows.shape[1])
+        for start in range(0, len(changed), step):
+            idx = changed[start:start+step]
+            via = np.minimum(ra[idx, None] + 1 + row_b, rb[idx, None] + 1 + row_a)
+            # unreachable cells hold h*w+1 and via never goes below a real distance
+            rows[idx] = np.minimum(rows[idx], via)
+    
+    @property
+    def _dist_dtype(self):
+        # unreachable cells are marked with h*w+1, as in the scripted AIs
+        return np.uint16 if self.h * self.w + 1 <= np.iinfo(np.uint16).max else np.uint32
+    
+    def _bfs(self, sources) -> np.ndarray:
+        '''Seeker distances (walls only) from each flat cell in sources, as [len(sources), h*w]'''
+        n = self.h * self.w
+        if self._passable is None:
+            self._passable = pathing.passable(self.field)
+        roots = np.zeros([len(sources), n], dtype=bool)
+        roots[np.arange(len(sources)), sources] = True
+        dist = pathing.distance_field(self._passable, roots.reshape(-1, self.h, self.w), n+1, self._dist_dtype)
+        return dist.reshape(-1, n)
+    
+    def distance(self, y, x) -> np.ndarray:
+        '''Return the [h, w] seeker distance field from (y, x).
+        
+        Rows come from the loaded distance table when there is one, otherwise
+        they are computed on first use and cached until the next generate().
+        The cache holds at most dist_cache_bytes of rows (and never fewer than
+        min_dist_rows), e.g. 52 rows of a 200x200 maze, evicting the least
+        recently used row, so a long episode on a large maze stays bounded.
+        '''
+        src = y * self.w + x
+        if self._dist_table is not None:
+            return self._dist_table[src].reshape(self.h, self.w)
+        # re-inserting keeps the dict in least to most recently used order
+        row = self._dist.pop(src, None)
+        if row is None:
+            row = self._bfs([src])[0]
+            if len(self._dist) >= max(self.min_dist_rows, self.dist_cache_bytes // row.nbytes):
+                del self._dist[next(iter(self._dist))]
+        self._dist[src] = row
+        return row.reshape(self.h, self.w)
+    
+    def nearest_distance(self, cells, rows = True) -> np.ndarray:
+        '''[h, w] seeker distance to the nearest of the [k, 2] (y, x) cells.
+        
+        With rows the minimum of the k distance rows is taken, which reuses
+        the table or the cached rows; otherwise one multi-source BFS is run,
+        whose cost does not grow with k.
+        '''
+        cells = np.asarray(cells)
+        if len(cells) == 1:
+            return self.distance(*cells[0])
+        if self._dist_table is not None:
+            return self._dist_table[cells[:, 0] * self.w + cells[:, 1]].min(axis=0).reshape(self.h, self.w)
+        if rows:
+            dist = self.distance(*cells[0])
+            for y, x in cells[1:]:
+                dist = np.minimum(dist, self.distance(y, x))
+            return dist
+        if self._passable is None:
+            self._passable = pathing.passable(self.field)
+        roots = np.zeros([self.h, self.w], dtype=bool)
+        roots[cells[:, 0], cells[:, 1]] = True
+        return pathing.distance_field(self._passable, roots, self.h * self.w + 1, self._dist_dtype)
+    
+    def distance_table(self) -> np.ndarray:
+        '''Return the all-pairs [h*w, h*w] seeker distance table of the maze'''
+        if self._dist_table is None:
+            n = self.h * self.w
+            table = np.empty([n, n], dtype=self._dist_dtype)
+            chunk = max(1, (1 << 22) // n) # bound the batched BFS to ~4M cells
+            for start in range(0, n, chunk):
+                table[start:start+chunk] = self._bfs(np.arange(start, min(start+chunk, n)))
+            self._dist_table = table
+        return self._dist_table
     
     def render(self):
         for j in range(self.w):
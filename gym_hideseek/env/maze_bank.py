@@ -0,0 +1,101 @@
+import json
+import os
+
+import numpy as np
+
+from gym_hideseek.env.labyrinth import Labyrinth
+
+
+def pack_field(field) -> np.ndarray:
+    '''Pack [..., 8, h, w] wall/window channels into one uint8 per cell (bit c = channel c)'''
+    bits = np.asarray(field, dtype=np.uint8) << np.arange(8, dtype=np.uint8)[:, None, None]
+    return np.bitwise_or.reduce(bits, axis=-3)
+
+
+def unpack_field(cells) -> np.ndarray:
+    '''Inverse of pack_field, returning the int32 [..., 8, h, w] field'''
+    cells = np.asarray(cells, dtype=np.uint8)[..., None, :, :]
+    return ((cells >> np.arange(8, dtype=np.uint8)[:, None, None]) & 1).astype(np.int32)
+
+
+class MazeBank:
+    '''A pool of pre-generated mazes stored on disk and read through np.memmap.
+
+    A bank is a directory holding meta.json, mazes.npy ([M, h, w] uint8
+    cells, see pack_field) and optionally distances.npy ([M, h*w, h*w]
+    distance tables). The arrays are opened read-only with mmap_mode='r',
+    so every process sampling from the bank shares the OS page cache.
+    '''
+    def __init__(self, path) -> None:
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.h = self.meta['h']
+        self.w = self.meta['w']
+        self.mazes = np.load(os.path.join(path, 'mazes.npy'), mmap_mode='r')
+        dist_path = os.path.join(path, 'distances.npy')
+        self.distances = np.load(dist_path, mmap_mode='r') if os.path.exists(dist_path) else None
+
+    def __len__(self) -> int:
+        return len(self.mazes)
+
+    def field(self, i) -> np.ndarray:
+        return unpack_field(self.mazes[i])
+
+    def distance_table(self, i):
+        return None if self.distances is None else self.distances[i]
+
+    def load(self, labyrinth, i) -> None:
+        '''Load maze i (and its distance table, if stored) into labyrinth'''
+        labyrinth.load(self.field(i), self.distance_table(i))
+
+    @staticmethod
+    def create(path, m, h, w, connectivity = .3, window_ratio = .1, seed = None, distances = False, batch = 1024) -> 'MazeBank':
+        '''Generate m mazes into a new bank at path and return it opened'''
+        os.makedirs(path, exist_ok=True)
+        rand = np.random.RandomState(seed)
+        mazes = np.lib.format.open_memmap(os.path.join(path, 'mazes.npy'), mode='w+', dtype=np.uint8, shape=(m, h, w))
+        if distances:
+            lbr = Labyrinth()
+            lbr.load(np.ones([8, h, w], dtype=np.int32))
+            table = np.lib.format.open_memmap(
+                os.path.join(path, 'distances.npy'), mode='w+', dtype=lbr._dist_dtype, shape=(m, h*w, h*w)
+            )
+        for start in range(0, m, batch):
+            fields = Labyrinth.generate_batch(min(batch, m - start), h, w, connectivity, window_ratio, rand)
+            mazes[start:start+len(fields)] = pack_field(fields)
+            if distances:
+                for i, field in enumerate(fields):
+                    lbr.load(field)
+                    table[start+i] = lbr.distance_table()
+        mazes.flush()
+        if distances:
+            table.flush()
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({
+                'h': h, 'w': w, 'connectivity': connectivity, 'window_ratio': window_ratio,
+                'seed': seed, 'count': m, 'distances': bool(distances)
+            }, f, indent=4)
+        return MazeBank(path)
+
+
+def _get_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='Pre-generate a maze bank for Hide_Seek')
+    parser.add_argument('--env-config', type=str, required=True, help='The environment config file')
+    parser.add_argument('-M', '--num-mazes', type=int, required=True, help='Number of mazes')
+    parser.add_argument('-o', '--output', type=str, required=True, help='Output bank directory')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--distances', action='store_true', help='Also store each maze\'s distance table')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = _get_args()
+    with open(args.env_config, 'r') as f:
+        env_config = json.load(f)
+    bank = MazeBank.create(
+        args.output, args.num_mazes, env_config['h'], env_config['w'],
+        env_config['connectivity'], env_config['window_ratio'],
+        seed=args.seed, distances=args.distances
+    )
+    print('Wrote {} {}x{} mazes to {}'.format(len(bank), bank.h, bank.w, args.output))
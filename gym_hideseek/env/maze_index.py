@@ -0,0 +1,172 @@
+import numpy as np
+
+from gym_hideseek.env import pathing
+
+
+def _articulation_points(moves, offset) -> np.ndarray:
+    '''Cut vertices of the grid graph given by the [n, 4] moves mask (iterative Tarjan)'''
+    n = len(moves)
+    adj = [(c + offset[moves[c]]).tolist() for c in range(n)]
+    disc = [-1] * n
+    low = [0] * n
+    cut = np.zeros(n, dtype=bool)
+    t = 0
+    for root in range(n):
+        if disc[root] >= 0:
+            continue
+        disc[root] = low[root] = t
+        t += 1
+        children = 0
+        stack = [(root, -1, iter(adj[root]))]
+        while stack:
+            u, parent, it = stack[-1]
+            for v in it:
+                if disc[v] < 0:
+                    disc[v] = low[v] = t
+                    t += 1
+                    stack.append((v, u, iter(adj[v])))
+                    break
+                if v != parent:
+                    low[u] = min(low[u], disc[v])
+            else:
+                stack.pop()
+                if parent < 0:
+                    continue
+                low[parent] = min(low[parent], low[u])
+                if parent == root:
+                    children += 1
+                elif low[u] >= disc[parent]:
+                    cut[parent] = True
+        cut[root] = children > 1
+    return cut
+
+
+class MazeIndex:
+    '''Structural properties of one maze, each computed on first use and then kept.
+
+    Built by Labyrinth.index and dropped with the maze, so every consumer
+    of a maze (env, wrappers, curriculum filters) shares one computation.
+    Cell properties are [h, w] arrays. The hider's graph includes the
+    windows, the seekers' graph only the open passages.
+      degree, dead_ends  hider moves out of each cell / cells with only one
+      articulation       cells whose removal splits the hider's maze (chokepoints)
+      windows, window_detour
+                         (y, x, d) of every window, and the seeker distance
+                         between its two cells (h*w+1 when they cannot meet)
+      diameter           longest seeker distance between two connected cells
+                         (exact, by BFS from cells whose eccentricity bound
+                         still exceeds the longest one found)
+    '''
+    def __init__(self, labyrinth) -> None:
+        self.labyrinth = labyrinth
+        self.h, self.w = labyrinth.h, labyrinth.w
+        self._hider_moves = pathing.passable(labyrinth.field, windows=True)
+        self._articulation = None
+        self._windows = None
+        self._window_detour = None
+        self._diameter = None
+        self._diameter_bounds = None
+
+    @property
+    def degree(self) -> np.ndarray:
+        return self._hider_moves.sum(axis=0)
+
+    @property
+    def dead_ends(self) -> np.ndarray:
+        return self.degree == 1
+
+    @property
+    def articulation(self) -> np.ndarray:
+        if self._articulation is None:
+            offset = np.array([dy * self.w + dx for dy, dx in pathing.offset_dirs])
+            moves = self._hider_moves.reshape(4, -1).T
+            self._articulation = _articulation_points(moves, offset).reshape(self.h, self.w)
+        return self._articulation
+
+    @property
+    def windows(self) -> np.ndarray:
+        if self._windows is None:
+            # count each window once, from the cell above or left of it
+            d, y, x = np.nonzero(self.labyrinth.field[[5, 7]] == 1)
+            self._windows = np.stack([y, x, np.where(d == 0, 1, 3)], axis=1)
+        return self._windows
+
+    @property
+    def window_detour(self) -> np.ndarray:
+        if self._window_detour is None:
+            y, x, d = self.windows.T
+            y2, x2 = y + (d == 1), x + (d == 3)
+            table = self.labyrinth._dist_table
+            if table is not None:
+                self._window_detour = table[y * self.w + x, y2 * self.w + x2].astype(np.int64)
+                return self._window_detour
+            roots = np.zeros([len(y), self.h, self.w], dtype=bool)
+            roots[np.arange(len(y)), y, x] = True
+            moves = pathing.passable(self.labyrinth.field)
+            detour = np.empty(len(y), dtype=np.int64)
+            chunk = max(1, (1 << 22) // (self.h * self.w))
+            for start in range(0, len(y), chunk):
+                part = slice(start, start + chunk)
+                dist = pathing.distance_field(moves, roots[part])
+                detour[part] = dist[np.arange(len(dist)), y2[part], x2[part]]
+            self._window_detour = detour
+        return self._window_detour
+
+    def escape_distance(self, y, x) -> int:
+        '''Longest seeker distance from (y, x) to a cell it can reach'''
+        dist = self.labyrinth.distance(y, x)
+        return int(dist[dist <= self.h * self.w].max())
+
+    def _bounds(self):
+        '''(lower, upper) bounds of the diameter from a double BFS sweep per component'''
+        if self._diameter_bounds is None:
+            # windows can cut the seekers' graph, so sweep each component; a
+            # component whose cells reach at most ecc from its start has a
+            # diameter of at most 2*ecc
+            n = self.h * self.w
+            unseen = np.ones(n, dtype=bool)
+            lower = upper = 0
+            while unseen.any():
+                dist = self.labyrinth.distance(*divmod(int(np.argmax(unseen)), self.w)).ravel()
+                reach = dist <= n
+                unseen &= ~reach
+                far = np.argmax(np.where(reach, dist, -1))
+                lower = max(lower, self.escape_distance(*divmod(int(far), self.w)))
+                upper = max(upper, 2 * int(dist[far]))
+            self._diameter_bounds = (lower, upper)
+        return self._diameter_bounds
+
+    @property
+    def diameter(self) -> int:
+        if self._diameter is None:
+            # the sweep is only exact on trees. A BFS from s gives ecc(s) and
+            # bounds every reached cell's eccentricity by d(s, v) + ecc(s), so
+            # BFS from the cell with the largest bound until no bound exceeds
+            # the longest eccentricity found (one component at a time)
+            n = self.h * self.w
+            lower = self._bounds()[0]
+            upper = np.full(n, n, dtype=np.int64)
+            while True:
+                src = int(np.argmax(upper))
+                if upper[src] <= lower:
+                    break
+                dist = self.labyrinth.distance(*divmod(src, self.w)).ravel().astype(np.int64)
+                reach = dist <= n
+                ecc = int(dist[reach].max())
+                lower = max(lower, ecc)
+                upper[reach] = np.minimum(upper[reach], dist[reach] + ecc)
+            self._diameter = lower
+        return self._diameter
+
+    def degenerate(self, min_diameter = 0, max_dead_end_ratio = 1.) -> bool:
+        '''Whether the maze is too small to run in, or mostly dead ends.
+
+        min_diameter is compared with the exact diameter, which is only
+        computed when the sweep bounds cannot decide.
+        '''
+        if self.dead_ends.mean() > max_dead_end_ratio:
+            return True
+        lower, upper = self._bounds()
+        if lower >= min_diameter:
+            return False
+        return upper < min_diameter or self.diameter < min_diameter
@@ -0,0 +1,106 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+from gym_hideseek.env.labyrinth import Labyrinth
+
+
+def bucket_key(h, w, connectivity, window_ratio):
+    return (int(h), int(w), float(connectivity), float(window_ratio))
+
+
+class MazeService:
+    '''Generate mazes in a background thread, ahead of the resets that need them.
+
+    Mazes are kept ready in one bounded queue of up to capacity fields per
+    (h, w, connectivity, window_ratio) bucket, and the thread refills the
+    emptiest bucket first, batch mazes at a time with Labyrinth.generate_batch.
+    Buckets are registered by request() (e.g. the next curriculum level, so
+    its mazes are ready before the first reset uses it) or on the first get().
+    Each bucket draws from its own RandomState seeded with seed and the bucket
+    key, so the maze sequence of a bucket does not depend on thread timing.
+    reseed() restarts every bucket from a new seed; an env that owns its
+    service reseeds it from every env.seed().
+    '''
+    def __init__(self, buckets = (), capacity = 16, batch = 4, seed = None) -> None:
+        self.capacity = capacity
+        self.batch = batch
+        self.seed = seed
+        self.misses = 0 # get() calls that had to wait for the thread
+        self._ready = {}
+        self._rand = {}
+        self._generation = 0 # bumped by reseed(), so batches drawn before it are dropped
+        self._cond = threading.Condition()
+        self._closed = False
+        for bucket in buckets:
+            self.request(*bucket)
+        self._thread = threading.Thread(target=self._run, name='MazeService', daemon=True)
+        self._thread.start()
+
+    def request(self, h, w, connectivity = 0., window_ratio = .1) -> None:
+        '''Start keeping mazes of this bucket ready'''
+        key = bucket_key(h, w, connectivity, window_ratio)
+        with self._cond:
+            if key not in self._ready:
+                self._rand[key] = self._bucket_rand(key)
+                self._ready[key] = deque()
+                self._cond.notify_all()
+
+    def _bucket_rand(self, key):
+        seed = None if self.seed is None else [self.seed, key[0], key[1], int(key[2] * 1e6), int(key[3] * 1e6)]
+        return np.random.RandomState(seed)
+
+    def reseed(self, seed) -> None:
+        '''Restart every bucket from seed, dropping the mazes already made'''
+        with self._cond:
+            self.seed = seed
+            self._generation += 1
+            for key in self._ready:
+                self._rand[key] = self._bucket_rand(key)
+                self._ready[key].clear()
+            self._cond.notify_all()
+
+    def get(self, h, w, connectivity = 0., window_ratio = .1) -> np.ndarray:
+        '''Take a ready [8, h, w] field of the bucket, waiting only if it is empty'''
+        key = bucket_key(h, w, connectivity, window_ratio)
+        self.request(*key)
+        with self._cond:
+            ready = self._ready[key]
+            if not ready:
+                self.misses += 1
+            while not ready:
+                assert not self._closed, 'the maze service is closed'
+                self._cond.wait()
+            field = ready.popleft()
+            self._cond.notify_all()
+        return field
+
+    def _next_bucket(self):
+        '''The emptiest bucket with room, or None when all are full'''
+        room = [(len(ready), key) for key, ready in self._ready.items() if len(ready) < self.capacity]
+        return min(room)[1] if room else None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                key = self._next_bucket()
+                while key is None and not self._closed:
+                    self._cond.wait()
+                    key = self._next_bucket()
+                if self._closed:
+                    return
+                n = min(self.batch, self.capacity - len(self._ready[key]))
+                rand, generation = self._rand[key], self._generation
+            # only this thread draws from the bucket generators
+            fields = Labyrinth.generate_batch(n, *key, rand=rand)
+            with self._cond:
+                if generation == self._generation:
+                    self._ready[key].extend(fields)
+                self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
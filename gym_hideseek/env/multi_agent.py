@@ -0,0 +1,101 @@
+try:
+    from ray.rllib.env.multi_agent_env import MultiAgentEnv
+except ImportError: # ray is only needed to train on this env
+    MultiAgentEnv = object
+
+from gym_hideseek.env.hide_seek import Hide_Seek
+
+
+class HideSeekMultiAgent(Hide_Seek, MultiAgentEnv):
+    '''The hider and both seekers playing on one shared maze, RLlib MultiAgentEnv style.
+
+    The agents are 'hider' (Discrete(5), as in Hider) and 'seeker'
+    (MultiDiscrete([5, 5]) for both seekers, as in Seeker); with n_hiders or
+    n_seekers each side controls all of its agents. Either side can
+    be left to its scripted AI with scripted='hider' or scripted='seeker';
+    it then no longer appears in the observation dicts. The schedule follows
+    the single-agent env of the learning side: with scripted='seeker' it
+    plays exactly like Hider, otherwise like Seeker (the hider moves every
+    other step, so it only gets an observation when it is due to act).
+    '''
+    agents = ['hider', 'seeker']
+
+    def __init__(self, h = 10, w = 15, connectivity = 0, window_ratio = .1, scripted = None, **kwargs) -> None:
+        assert scripted in (None, 'hider', 'seeker'), 'scripted must be None, hider or seeker'
+        self.scripted = scripted
+        self.max_steps = 1000 if scripted == 'seeker' else 2000
+        self._rewards = dict.fromkeys(self.agents, 0)
+        super().__init__(h, w, connectivity, window_ratio, **kwargs)
+        self._agent_ids = set(a for a in self.agents if a != scripted)
+        self.action_spaces = {
+            'hider': self._hider_action_space(), # U D L R NOP
+            'seeker': self._seeker_action_space()
+        }
+        self.observation_spaces = {
+            'hider': self._observation_space(self.max_h, self.max_w, self.n_hiders),
+            'seeker': self._observation_space(self.max_h, self.max_w, self.n_seekers)
+        }
+
+    def _acting(self):
+        '''Learning agents that act on the next step'''
+        acting = []
+        if self.scripted is None and self.steps % 2 == 0 or self.scripted == 'seeker':
+            acting.append('hider')
+        if self.scripted != 'seeker':
+            acting.append('seeker')
+        return acting
+
+    @property
+    def state(self):
+        return self._emit(self._acting())[0]
+
+    def _emit(self, agents):
+        self._draw_agents()
+        positions = {'hider': self.hiders, 'seeker': self.seekers}
+        obs = {a: self._observe(positions[a]) for a in agents}
+        rewards = {a: self._rewards[a] for a in agents}
+        for a in agents:
+            self._rewards[a] = 0
+        return obs, rewards
+
+    def reset(self, options = None):
+        self._rewards = dict.fromkeys(self.agents, 0)
+        return super().reset(options)
+
+    def step(self, action_dict):
+        for agent in self._acting():
+            assert agent in action_dict and self.action_spaces[agent].contains(action_dict[agent]), \
+                "%r (%s) invalid for %s" % (action_dict.get(agent), type(action_dict.get(agent)), agent)
+
+        hider_moves = self.scripted == 'seeker' or self.steps % 2 == 0
+        if self.scripted == 'seeker':
+            self.move_hider(action_dict['hider'])
+            self.seeker_ai()
+        else:
+            self.move_seekers(action_dict['seeker'])
+            if hider_moves:
+                if self.scripted == 'hider':
+                    self.hider_ai()
+                else:
+                    self.move_hider(action_dict['hider'])
+
+        hider_reward = 1 if hider_moves else 0
+        seeker_reward = -1
+        self.steps += 1
+        done = self.steps > self.max_steps
+
+        if self.check_catch():
+            hider_reward = -1
+            seeker_reward = 1
+            done = True
+
+        self._rewards['hider'] += hider_reward
+        self._rewards['seeker'] += seeker_reward
+
+        agents = [a for a in self.agents if a != self.scripted] if done else self._acting()
+        obs, rewards = self._emit(agents)
+        dones = {a: done for a in agents}
+        dones['__all__'] = done
+        infos = {a: self._info() for a in agents}
+
+        return obs, rewards, dones, infos
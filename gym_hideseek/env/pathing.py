@@ -0,0 +1,52 @@
+import numpy as np
+
+
+offset_dirs = [[-1, 0], [1, 0], [0, -1], [0, 1]] # U D L R
+
+
+def passable(field, windows=False) -> np.ndarray:
+    '''Return the boolean [..., 4, h, w] mask of moves allowed from each cell.
+
+    Walls (field[0:4]) block every agent; with windows=True the windows
+    (field[4:8]) are passable as well, which is how the hider moves.
+    '''
+    mask = field[..., 0:4, :, :] == 0
+    if windows:
+        mask |= field[..., 4:8, :, :] == 1
+    # never step off the grid, even on a maze with an open border
+    mask[..., 0, 0, :] = False
+    mask[..., 1, -1, :] = False
+    mask[..., 2, :, 0] = False
+    mask[..., 3, :, -1] = False
+    return mask
+
+
+def distance_field(passable, sources, fill=None, dtype=np.int32) -> np.ndarray:
+    '''Multi-source BFS distance over one or a batch of grids.
+
+    passable is a [..., 4, h, w] mask as returned by passable() and sources a
+    boolean [..., h, w] mask of the BFS roots; every grid of the batch is
+    searched independently. Each BFS layer is expanded with a few array
+    operations over the frontier cells, so the cost grows with the number of
+    reached cells rather than with the Python work per cell. Unreached cells
+    keep fill (h*w+1 by default, as in the scripted AIs).
+    '''
+    shape = sources.shape
+    h, w = shape[-2:]
+    n = sources.size
+    if fill is None:
+        fill = h * w + 1
+    moves = np.moveaxis(np.broadcast_to(passable, shape[:-2] + (4, h, w)), -3, -1).reshape(n, 4)
+    offset = np.array([dy * w + dx for dy, dx in offset_dirs])
+
+    dist = np.full(n, fill, dtype=dtype)
+    frontier = np.flatnonzero(sources)
+    dist[frontier] = 0
+    d = 0
+    while frontier.size:
+        d += 1
+        nxt = (frontier[:, None] + offset)[moves[frontier]]
+        nxt = np.unique(nxt[dist[nxt] == fill])
+        dist[nxt] = d
+        frontier = nxt
+    return dist.reshape(shape)
@@ -0,0 +1,67 @@
+import numpy as np
+
+block_width = 30
+wall_width = 3
+agent_margin = 10
+
+background = (255, 255, 255)
+colors = {
+    'wall': (0, 0, 0),
+    'window': (0, 255, 0),
+    'hider': (0, 0, 255),
+    'seeker': (255, 0, 0),
+}
+
+
+def _edge_templates():
+    '''Pixel masks of the U D L R edges within one block'''
+    t = np.zeros([4, block_width, block_width], dtype=bool)
+    t[0, :wall_width, :] = True
+    t[1, -wall_width:, :] = True
+    t[2, :, :wall_width] = True
+    t[3, :, -wall_width:] = True
+    return t
+
+_templates = _edge_templates()
+
+
+def maze_layer(field) -> np.ndarray:
+    '''Paint the walls and windows of one or a batch of [..., 8, h, w] fields.
+
+    Returns a [..., h*block_width, w*block_width, 3] uint8 image, laid out
+    like the pyglet viewer output (row 0 of the maze at the top).
+    '''
+    field = np.asarray(field)
+    batch = field.shape[:-3]
+    h, w = field.shape[-2:]
+    image = np.empty(batch + (h*block_width, w*block_width, 3), dtype=np.uint8)
+    image[...] = background
+    for first, color in ((0, colors['wall']), (4, colors['window'])):
+        mask = np.zeros(batch + (h, block_width, w, block_width), dtype=bool)
+        for d in range(4):
+            # [..., h, 1, w, 1] & [block, 1, block] paints edge d of every cell
+            mask |= (field[..., first+d, :, None, :, None] != 0) & _templates[d, :, None, :]
+        image[mask.reshape(batch + (h*block_width, w*block_width))] = color
+    return image
+
+
+def draw_agents(image, hider, seeker) -> np.ndarray:
+    '''Draw agents in place on contiguous [..., H, W, 3] images.
+
+    hider is a [..., 2] and seeker a [..., n, 2] array of (y, x) positions.
+    '''
+    flat = image.reshape((-1,) + image.shape[-3:])
+    offset = np.arange(agent_margin, block_width - agent_margin)
+    b = np.arange(len(flat))[:, None, None, None]
+    for pos, color in ((np.asarray(hider)[..., None, :], colors['hider']), (np.asarray(seeker), colors['seeker'])):
+        pos = pos.reshape(len(flat), -1, 2)
+        rows = (pos[..., 0] * block_width)[..., None, None] + offset[:, None]
+        cols = (pos[..., 1] * block_width)[..., None, None] + offset[None, :]
+        flat[b, rows, cols] = color
+    return image
+
+
+def render(field, hider, seeker, layer = None) -> np.ndarray:
+    '''RGB image of one or a batch of games; pass a cached maze_layer() as layer to skip repainting the maze'''
+    image = maze_layer(field) if layer is None else layer.copy()
+    return draw_agents(image, hider, seeker)
@@ -0,0 +1,182 @@
+import os
+import struct
+
+import gym
+import numpy as np
+
+from gym_hideseek.env import raster
+from gym_hideseek.env.maze_bank import pack_field, unpack_field
+
+# An episode file is a sequence of appendable chunks, each one
+#   magic (4s) | kind (B) | writer (I) | episode (I) | payload length (I) | payload
+# MAZE chunks hold h (H), w (H), seekers (B) and the packed [h, w] cells,
+# STEPS chunks hold rows of _step_dtype(seekers). Episodes are numbered
+# per writer, so (writer, episode) identifies one.
+_header = struct.Struct('<4sBIII')
+_maze_header = struct.Struct('<HHB')
+_magic = b'HSEP'
+MAZE = 0
+STEPS = 1
+
+
+def _step_dtype(n_seekers):
+    return np.dtype([
+        ('step', '<u4'),
+        ('action', 'i1', (n_seekers,)), # the hider only uses action[0]
+        ('hider', '<i2', (2,)),
+        ('seeker', '<i2', (n_seekers, 2)),
+        ('reward', '<i2'),
+        ('done', 'u1'),
+    ])
+
+
+def _chunks(f):
+    '''Yield (offset, kind, (writer, episode), length) of every chunk of an episode file'''
+    offset = 0
+    while True:
+        f.seek(offset)
+        head = f.read(_header.size)
+        if len(head) < _header.size:
+            return
+        magic, kind, writer, episode, length = _header.unpack(head)
+        assert magic == _magic, 'corrupt episode file at offset {}'.format(offset)
+        yield offset, kind, (writer, episode), length
+        offset += _header.size + length
+
+
+class EpisodeRecorder(gym.Wrapper):
+    '''Record Hider/Seeker episodes as mazes plus per-step positions and actions.
+
+    Each recorded episode costs one packed maze (one byte per cell) and a
+    few bytes per step, written in chunks of chunk_steps rows to path,
+    which is appended to across runs. Only a sample_rate fraction of the
+    episodes is recorded; the draw uses its own generator so the wrapped
+    env's np_random sequence is left untouched.
+
+    Several processes (e.g. RLlib rollout workers) may append to one file:
+    chunks carry the writer id (the pid unless given, e.g. the worker
+    index) and each goes out in a single write to the O_APPEND file, so
+    on a local filesystem chunks of different writers never interleave.
+    On a network filesystem give every process its own file.
+    Episode.observation rebuilds the default observation, so the env
+    must use the float32 encoding without obs_crop or max_size padding.
+    '''
+    def __init__(self, env, path, sample_rate = 1., chunk_steps = 256, seed = None, writer = None) -> None:
+        super().__init__(env)
+        assert getattr(env, 'n_hiders', 1) == 1, 'episodes are recorded with a single hider'
+        assert not getattr(env, 'partial_obs', False), 'recorded observations are rebuilt with full visibility'
+        assert getattr(env, 'obs_encoding', 'float32') == 'float32' and getattr(env, 'obs_crop', None) is None, \
+            'recorded observations are rebuilt as uncropped float32'
+        self.path = path
+        self.sample_rate = sample_rate
+        self.chunk_steps = chunk_steps
+        self.writer = os.getpid() if writer is None else writer
+        self._rand = np.random.RandomState(seed)
+        self._episode = 0
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for _, kind, (writer, episode), _ in _chunks(f):
+                    if kind == MAZE and writer == self.writer:
+                        self._episode = max(self._episode, episode + 1)
+        self._rows = None
+
+    def _write(self, kind, payload):
+        # unbuffered, so header and payload reach the file in one write
+        with open(self.path, 'ab', buffering=0) as f:
+            f.write(_header.pack(_magic, kind, self.writer, self._episode, len(payload)) + payload)
+
+    def _flush(self):
+        if self._rows:
+            n_seekers = len(self.env.seeker)
+            self._write(STEPS, np.array(self._rows, dtype=_step_dtype(n_seekers)).tobytes())
+            self._rows = []
+
+    def _record(self, action, reward, done):
+        actions = np.full(len(self.env.seeker), -1)
+        actions[:np.size(action)] = np.ravel(action)
+        # positions are mutated in place by the env, so copy them now
+        self._rows.append((self.env.steps, actions, tuple(self.env.hider), [tuple(s) for s in self.env.seeker], reward, done))
+        if done or len(self._rows) >= self.chunk_steps:
+            self._flush()
+
+    def reset(self, **kwargs):
+        if self._rows is not None:
+            self._flush()
+            self._episode += 1
+        obs = self.env.reset(**kwargs)
+        self._rows = None
+        if self._rand.random_sample() < self.sample_rate:
+            field = self.env.field
+            assert (field.h, field.w) == self.env.observation_space.shape[:2], 'recorded observations are rebuilt without max_size padding'
+            self._write(MAZE, _maze_header.pack(field.h, field.w, len(self.env.seeker)) + pack_field(field.field).tobytes())
+            self._rows = []
+            self._record(-1, 0, False)
+        return obs
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        if self._rows is not None:
+            self._record(action, reward, done)
+        return obs, reward, done, info
+
+    def close(self):
+        if self._rows is not None:
+            self._flush()
+        return super().close()
+
+
+class Episode:
+    '''One recorded episode; rows[t] is the state after t steps'''
+    def __init__(self, field, rows) -> None:
+        self.field = field
+        self.rows = rows
+        self.h, self.w = field.shape[1:]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def observation(self, t) -> np.ndarray:
+        '''The float32 [h, w, 10] observation the env returned at step t'''
+        row = self.rows[t]
+        s = np.zeros([self.h, self.w, 10], dtype=np.float32)
+        s[..., 0:8] = self.field.transpose([1, 2, 0])
+        s[row['hider'][0], row['hider'][1], 8] = 1
+        s[row['seeker'][:, 0], row['seeker'][:, 1], 9] = 1
+        return s
+
+    def render(self, t, layer = None) -> np.ndarray:
+        row = self.rows[t]
+        return raster.render(self.field, row['hider'], row['seeker'], layer)
+
+
+class EpisodeReader:
+    '''Random access to the episodes of a file written by EpisodeRecorder.
+
+    episodes holds the (writer, episode) keys in order.
+    '''
+    def __init__(self, path) -> None:
+        self.path = path
+        self._index = {}
+        with open(path, 'rb') as f:
+            for offset, kind, episode, length in _chunks(f):
+                if kind == MAZE:
+                    self._index[episode] = (offset, [])
+                elif episode in self._index:
+                    self._index[episode][1].append((offset, length))
+        self.episodes = sorted(self._index)
+
+    def __len__(self) -> int:
+        return len(self.episodes)
+
+    def __getitem__(self, i) -> Episode:
+        '''Read the i-th recorded episode'''
+        maze, steps = self._index[self.episodes[i]]
+        with open(self.path, 'rb') as f:
+            f.seek(maze + _header.size)
+            h, w, n_seekers = _maze_header.unpack(f.read(_maze_header.size))
+            field = unpack_field(np.frombuffer(f.read(h * w), dtype=np.uint8).reshape(h, w))
+            payload = []
+            for offset, length in steps:
+                f.seek(offset + _header.size)
+                payload.append(f.read(length))
+        return Episode(field, np.frombuffer(b''.join(payload), dtype=_step_dtype(n_seekers)))
@@ -0,0 +1,150 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import gym_hideseek.env as hs_env
+
+
+def _make_env(env, env_config):
+    '''env is a class name from gym_hideseek.env or a picklable factory'''
+    factory = getattr(hs_env, env) if isinstance(env, str) else env
+    return factory(**env_config)
+
+
+def _layout(num_envs, obs_shape, obs_dtype, act_shape):
+    '''(name, dtype, shape, offset) of every array in the shared block, and its size'''
+    arrays = [
+        ('obs', np.dtype(obs_dtype), (num_envs,) + tuple(obs_shape)),
+        ('reward', np.dtype(np.float32), (num_envs,)),
+        ('done', np.dtype(bool), (num_envs,)),
+        ('action', np.dtype(np.int64), (num_envs,) + tuple(act_shape)),
+    ]
+    layout = []
+    offset = 0
+    for name, dtype, shape in arrays:
+        layout.append((name, dtype, shape, offset))
+        offset += -(-int(np.prod(shape)) * dtype.itemsize // 64) * 64 # keep every array 64-byte aligned
+    return layout, max(offset, 1)
+
+
+def _views(buf, layout):
+    return {name: np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset) for name, dtype, shape, offset in layout}
+
+
+def _serve(conn, arrays, env, env_config, lo, hi, seed):
+    envs = [_make_env(env, env_config) for _ in range(lo, hi)]
+    for i, e in enumerate(envs):
+        e.seed(None if seed is None else seed + lo + i)
+    obs, reward, done, action = arrays['obs'], arrays['reward'], arrays['done'], arrays['action']
+    while True:
+        cmd = conn.recv()
+        reply = True
+        if cmd == 'step':
+            # only non-empty infos go back over the pipe, which without
+            # profiling are those of the (rare) done envs
+            reply = {}
+            for i, e in enumerate(envs, lo):
+                act = action[i]
+                o, r, d, info = e.step(int(act) if act.ndim == 0 else act)
+                if d:
+                    info = dict(info, terminal_observation=np.array(o))
+                    o = e.reset()
+                if info:
+                    reply[i] = info
+                obs[i] = o
+                reward[i] = r
+                done[i] = d
+        elif cmd == 'reset':
+            for i, e in enumerate(envs, lo):
+                obs[i] = e.reset()
+        elif cmd == 'close':
+            for e in envs:
+                e.close()
+            conn.send(True)
+            return
+        conn.send(reply)
+
+
+def _worker(conn, shm_name, layout, env, env_config, lo, hi, seed):
+    # workers share the parent's resource tracker, which unlinks the block if the parent dies
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        _serve(conn, _views(shm.buf, layout), env, env_config, lo, hi, seed)
+    finally:
+        shm.close()
+
+
+class SubprocVecEnv:
+    '''Step num_envs Hider/Seeker envs in num_workers processes.
+
+    Each worker owns a contiguous slice of the envs. Actions, observations,
+    rewards and dones are exchanged through one multiprocessing.shared_memory
+    block, so the pipes only carry short commands. Env i is seeded with
+    seed + i through Hide_Seek.seed, like VecHideSeek, and is reset
+    automatically when it is done (the returned observation is then the
+    first one of the next episode, and infos[i]['terminal_observation']
+    the last one of the finished episode). Infos the envs return, such as
+    the profile of profile=True envs, are passed through.
+    '''
+    def __init__(self, env, num_envs, num_workers = None, env_config = None, seed = None, context = None) -> None:
+        env_config = {} if env_config is None else env_config
+        num_workers = min(num_envs, num_workers or mp.cpu_count())
+        probe = _make_env(env, env_config)
+        self.single_observation_space = probe.observation_space
+        self.single_action_space = probe.action_space
+        self.num_envs = num_envs
+        act_shape = getattr(probe.action_space, 'nvec', np.zeros(())).shape
+        probe.close()
+
+        layout, size = _layout(num_envs, self.single_observation_space.shape, self.single_observation_space.dtype, act_shape)
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._arrays = _views(self._shm.buf, layout)
+
+        ctx = mp.get_context(context)
+        bounds = np.linspace(0, num_envs, num_workers + 1).astype(int)
+        self._conns = []
+        self._procs = []
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(
+                target=_worker, args=(child, self._shm.name, layout, env, env_config, int(lo), int(hi), seed), daemon=True
+            )
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+        self.closed = False
+
+    def _command(self, cmd):
+        for conn in self._conns:
+            conn.send(cmd)
+        return [conn.recv() for conn in self._conns]
+
+    def reset(self):
+        self._command('reset')
+        return self._arrays['obs'].copy()
+
+    def step(self, actions):
+        '''Step every env; returns copies of the [num_envs, ...] obs, rewards and dones'''
+        self._arrays['action'][...] = actions
+        infos = [{} for _ in range(self.num_envs)]
+        for reply in self._command('step'):
+            for i, info in reply.items():
+                infos[i] = info
+        return self._arrays['obs'].copy(), self._arrays['reward'].copy(), self._arrays['done'].copy(), infos
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._command('close')
+        for proc in self._procs:
+            proc.join()
+        self._arrays = None
+        self._shm.close()
+        self._shm.unlink()
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.close()
@@ -0,0 +1,286 @@
+from gym import spaces
+from gym.utils import seeding
+
+import numpy as np
+
+from gym_hideseek.env.labyrinth import Labyrinth
+from gym_hideseek.env import pathing, raster
+
+
+class VecHideSeek:
+    '''N Hide & Seek episodes stepped together as stacked arrays.
+
+    field is [N, 8, h, w], hider is [N, 2] and seeker is [N, n_seekers, 2]. Every
+    sub-env owns its own np_random, so sub-env i behaves exactly like a
+    single Hider/Seeker seeded with the i-th seed returned by seed().
+    The scripted AIs cache each sub-env's walls and distance rows until
+    reset_at, so field is only changed through it.
+    '''
+    direction = np.array([[-1, 0], [1, 0], [0, -1], [0, 1], [0, 0]], dtype=np.int64) # U D L R NOP
+    max_steps = None
+    # the scripted AIs keep the distance rows they use per sub-env, as Labyrinth
+    # does, when all N [h*w, h*w] tables fit in this many bytes; beyond it they
+    # run one batched BFS per step over the sub-envs that move
+    dist_table_bytes = 128 << 20
+
+    def __init__(self, num_envs, h, w, connectivity, window_ratio, n_seekers = 2) -> None:
+        self.num_envs = num_envs
+        self.single_observation_space = spaces.Box(low=0., high=1., shape=[h, w, 10], dtype=np.float32)
+        self.observation_space = spaces.Box(low=0., high=1., shape=[num_envs, h, w, 10], dtype=np.float32)
+
+        self.h = h
+        self.w = w
+        self.conn = connectivity
+        self.window_ratio = window_ratio
+        self.labyrinth = Labyrinth()
+        self.field = np.ones([num_envs, 8, h, w], dtype=np.int32)
+        self.hider = np.zeros([num_envs, 2], dtype=np.int64)
+        self.seeker = np.zeros([num_envs, n_seekers, 2], dtype=np.int64)
+        self.steps = np.zeros(num_envs, dtype=np.int64)
+        self._index = np.arange(num_envs)
+        self._maze_layers = None
+        self._stale_layers = np.ones(num_envs, dtype=bool)
+        self._walls = None
+        self._rows = None
+
+        self.seed()
+        self.reset()
+
+    @classmethod
+    def from_games(cls, field, hider, seeker, steps):
+        '''Wrap existing games without generating mazes, e.g. to roll branches forward with advance().
+
+        field may be a read-only broadcast view when every game shares one maze.
+        '''
+        env = cls.__new__(cls)
+        env.num_envs, _, env.h, env.w = field.shape
+        env.field = field
+        env.hider = np.array(hider, dtype=np.int64).reshape(env.num_envs, 2)
+        env.seeker = np.array(seeker, dtype=np.int64).reshape(env.num_envs, -1, 2)
+        env.steps = np.array(steps, dtype=np.int64).reshape(env.num_envs)
+        env._index = np.arange(env.num_envs)
+        env._maze_layers = None
+        env._stale_layers = np.ones(env.num_envs, dtype=bool)
+        env._walls = None
+        env._rows = None
+        return env
+
+    def seed(self, seed=None):
+        '''Seed sub-env i with seed + i (or fresh entropy when seed is None)'''
+        self.np_random = []
+        seeds = []
+        for i in range(self.num_envs):
+            rng, s = seeding.np_random(None if seed is None else seed + i)
+            self.np_random.append(rng)
+            seeds.append(s)
+        return seeds
+
+    def reset_at(self, i):
+        '''Regenerate the maze and spawn positions of sub-env i'''
+        rand = self.np_random[i]
+        self.labyrinth.generate(self.h, self.w, self.conn, self.window_ratio, rand)
+        self.field[i] = self.labyrinth.field
+        self.hider[i] = [rand.randint(0, self.h), rand.randint(0, self.w)]
+        for s in range(self.seeker.shape[1]):
+            self.seeker[i, s] = [rand.randint(0, self.h), rand.randint(0, self.w)]
+        self.steps[i] = 0
+        self._stale_layers[i] = True
+        if self._walls is not None:
+            self._walls[i] = pathing.passable(self.field[i])
+        if self._rows is not None:
+            self._have[i] = False
+
+    def reset(self):
+        for i in range(self.num_envs):
+            self.reset_at(i)
+        return self.state
+
+    @property
+    def state(self):
+        s = np.zeros([self.num_envs, self.h, self.w, 10], dtype=np.float32)
+        s[..., 0:8] = self.field.transpose([0, 2, 3, 1])
+        s[self._index, self.hider[:, 0], self.hider[:, 1], 8] = 1
+        s[self._index[:, None], self.seeker[..., 0], self.seeker[..., 1], 9] = 1
+        return s
+
+    def render(self, mode='rgb_array'):
+        '''[N, H, W, 3] uint8 frames of every sub-env; maze layers are repainted only after a reset'''
+        assert mode == 'rgb_array', 'VecHideSeek only renders rgb_array frames'
+        if self._maze_layers is None:
+            self._maze_layers = raster.maze_layer(self.field)
+        elif self._stale_layers.any():
+            self._maze_layers[self._stale_layers] = raster.maze_layer(self.field[self._stale_layers])
+        self._stale_layers[:] = False
+        return raster.render(self.field, self.hider, self.seeker, self._maze_layers)
+    
+    def close(self):
+        pass
+    
+    def _cell(self, channel, pos):
+        '''Gather field[n, channel[n, ...], pos[n, ..., 0], pos[n, ..., 1]]'''
+        idx = self._index.reshape([-1] + [1] * (pos.ndim - 2))
+        return self.field[idx, channel, pos[..., 0], pos[..., 1]]
+
+    def _neighbour_dist(self, dist, pos):
+        '''dist of the four neighbours of pos, as a [..., 4] array'''
+        idx = self._index.reshape([-1] + [1] * (pos.ndim - 1))
+        newp = pos[..., None, :] + self.direction[None, :4]
+        newp[..., 0].clip(0, self.h - 1, out=newp[..., 0])
+        newp[..., 1].clip(0, self.w - 1, out=newp[..., 1])
+        return dist[idx, newp[..., 0], newp[..., 1]]
+
+    def _distance(self, env, cells):
+        '''[len(env), h, w] seeker distances from the [k, ...] (y, x) cells of sub-envs env
+        (from the nearest one, with several cells per sub-env)'''
+        n = self.h * self.w
+        if self._walls is None: # the walls only change at reset_at
+            self._walls = pathing.passable(self.field)
+            if self.num_envs * n * n * 2 <= self.dist_table_bytes:
+                self._rows = np.empty([self.num_envs, n, n], dtype=np.uint16)
+                self._have = np.zeros([self.num_envs, n], dtype=bool)
+        src = (cells[..., 0] * self.w + cells[..., 1]).reshape(len(env), -1)
+        if self._rows is None:
+            sources = np.zeros([len(env), n], dtype=bool)
+            sources[np.arange(len(env))[:, None], src] = True
+            return pathing.distance_field(self._walls[env], sources.reshape(-1, self.h, self.w))
+        owner = np.broadcast_to(env[:, None], src.shape)
+        miss = ~self._have[owner, src]
+        if miss.any():
+            # one BFS over every row not computed yet, each in its own grid
+            key = np.unique(owner[miss] * n + src[miss])
+            grid, cell = np.divmod(key, n)
+            sources = np.zeros([len(key), n], dtype=bool)
+            sources[np.arange(len(key)), cell] = True
+            self._rows[grid, cell] = pathing.distance_field(
+                self._walls[grid], sources.reshape(-1, self.h, self.w), dtype=np.uint16
+            ).reshape(-1, n)
+            self._have[grid, cell] = True
+        return self._rows[owner, src].min(axis=1).astype(np.int32).reshape(-1, self.h, self.w)
+
+    def _nearest(self, cells, active=None):
+        '''[N, h, w] distances from the nearest of each sub-env's cells, zero outside active'''
+        if active is None or active.all():
+            return self._distance(self._index, cells)
+        dist = np.zeros([self.num_envs, self.h, self.w], dtype=np.int32)
+        env = np.flatnonzero(active)
+        if len(env):
+            dist[env] = self._distance(env, cells[env])
+        return dist
+
+    def _hider_dist(self, active=None):
+        return self._nearest(self.hider, active)
+
+    def seeker_ai(self, active=None):
+        '''Vectorized Hide_Seek.seeker_ai for every sub-env (or those in active)'''
+        dist = self._hider_dist(active)
+        moves = np.ones(self.num_envs, dtype=bool) if active is None else active
+        self.seeker += self.direction[self._chase(dist, moves)]
+        self.seeker += self.direction[self._chase(dist, moves & (self.steps % 2 == 1))]
+
+    def seeker_actions(self):
+        '''[N, seekers] actions of one seeker_ai chase step, as a Seeker policy'''
+        return self._chase(self._hider_dist(), np.ones(self.num_envs, dtype=bool))
+
+    def _chase(self, dist, moves):
+        idx = self._index[:, None]
+        here = dist[idx, self.seeker[..., 0], self.seeker[..., 1]]
+        open_ = self.field[idx[..., None], np.arange(4), self.seeker[..., 0, None], self.seeker[..., 1, None]] == 0
+        ndist = self._neighbour_dist(dist, self.seeker)
+        ndist = np.where(open_, ndist, np.iinfo(np.int32).max)
+        best = ndist.argmin(axis=-1)
+        step = (np.take_along_axis(ndist, best[..., None], -1)[..., 0] < here) & moves[:, None]
+        return np.where(step, best, 4)
+
+    def hider_ai(self, active=None):
+        '''Vectorized Hide_Seek.hider_ai for every sub-env (or those in active)'''
+        self.hider += self.direction[self.hider_actions(active)]
+
+    def hider_actions(self, active=None):
+        '''[N] actions hider_ai takes (4 outside active), as a Hider policy'''
+        dist = self._nearest(self.seeker, active)
+
+        moves = np.ones(self.num_envs, dtype=bool) if active is None else active
+        here = dist[self._index, self.hider[:, 0], self.hider[:, 1]]
+        cell = self.field[self._index, :, self.hider[:, 0], self.hider[:, 1]]
+        passable = (cell[:, 0:4] == 0) | (cell[:, 4:8] == 1)
+        ndist = self._neighbour_dist(dist, self.hider)
+        ndist = np.where(passable, ndist, -1)
+        best = ndist.argmax(axis=-1)
+        step = (ndist[self._index, best] > here) & moves
+        return np.where(step, best, 4)
+
+    @property
+    def caught(self):
+        return (self.seeker == self.hider[:, None, :]).all(-1).any(-1)
+
+    def step(self, action):
+        return self._finish(*self.advance(action))
+
+    def _finish(self, reward, done):
+        '''Auto-reset finished sub-envs and build the batched step result'''
+        infos = [{} for _ in range(self.num_envs)]
+        obs = self.state
+        for i in np.flatnonzero(done):
+            infos[i]['terminal_observation'] = obs[i].copy()
+            self.reset_at(i)
+        if done.any():
+            obs = self.state
+        return obs, reward, done, infos
+
+
+class VecHider(VecHideSeek):
+    max_steps = 1000
+
+    def __init__(self, num_envs, h = 10, w = 15, connectivity = 0, window_ratio = .1, n_seekers = 2) -> None:
+        super().__init__(num_envs, h, w, connectivity, window_ratio, n_seekers)
+        self.single_action_space = spaces.Discrete(5) # U D L R NOP
+        self.action_space = spaces.MultiDiscrete([5] * num_envs)
+
+    def advance(self, action):
+        '''Apply one step to every game and return (reward, done), without observing or resetting'''
+        action = np.asarray(action, dtype=np.int64)
+        assert action.shape == (self.num_envs,) and ((action >= 0) & (action < 5)).all(), "%r (%s) invalid" % (action, type(action))
+
+        wall = np.minimum(action, 3)
+        move = (action != 4) & (
+            (self._cell(wall, self.hider) == 0) | (self._cell(wall + 4, self.hider) == 1)
+        )
+        self.hider += self.direction[np.where(move, action, 4)]
+
+        self.seeker_ai()
+
+        self.steps += 1
+        done = self.steps > self.max_steps
+        caught = self.caught
+        reward = np.where(caught, -1, 1)
+        done |= caught
+
+        return reward, done
+
+
+class VecSeeker(VecHideSeek):
+    max_steps = 2000
+
+    def __init__(self, num_envs, h = 10, w = 15, connectivity = 0, window_ratio = .1, n_seekers = 2) -> None:
+        super().__init__(num_envs, h, w, connectivity, window_ratio, n_seekers)
+        self.single_action_space = spaces.MultiDiscrete([5] * n_seekers) # U D L R NOP
+        self.action_space = spaces.MultiDiscrete([[5] * n_seekers] * num_envs)
+
+    def advance(self, action):
+        '''Apply one step to every game and return (reward, done), without observing or resetting'''
+        action = np.asarray(action, dtype=np.int64)
+        assert action.shape == (self.num_envs, self.seeker.shape[1]) and ((action >= 0) & (action < 5)).all(), \
+            "%r (%s) invalid" % (action, type(action))
+
+        move = (action != 4) & (self._cell(np.minimum(action, 3), self.seeker) == 0)
+        self.seeker += self.direction[np.where(move, action, 4)]
+
+        self.hider_ai(self.steps % 2 == 0)
+
+        self.steps += 1
+        done = self.steps > self.max_steps
+        caught = self.caught
+        reward = np.where(caught, 1, -1)
+        done |= caught
+
+        return reward, done
@@ -0,0 +1,141 @@
+import functools
+
+import numpy as np
+
+from gym_hideseek.env import pathing
+
+
+def _sight_line(dy, dx):
+    '''Steps of the ray between the centres of two cells (dy, dx) apart.
+
+    Each step is a pair of two-edge routes ((y, x, d), (y, x, d)), relative
+    to the first cell; a step that crosses a single edge repeats it. The
+    ray passes a step when both edges of either route are open, so a ray
+    through the corner of four cells gets past if one side of it is open.
+    '''
+    ny, nx = abs(dy), abs(dx)
+    sy, sx = (1 if dy > 0 else -1), (1 if dx > 0 else -1)
+    vert, horz = (1 if dy > 0 else 0), (3 if dx > 0 else 2) # D / U, R / L
+    y = x = i = j = 0
+    steps = []
+    while i < nx or j < ny:
+        # compare where the ray leaves the cell: through a vertical edge,
+        # a horizontal one, or exactly through the corner
+        side = (1 + 2*i) * ny - (1 + 2*j) * nx
+        if side < 0:
+            edge = (y, x, horz)
+            steps.append((edge, edge, edge, edge))
+            x += sx
+            i += 1
+        elif side > 0:
+            edge = (y, x, vert)
+            steps.append((edge, edge, edge, edge))
+            y += sy
+            j += 1
+        else:
+            steps.append(((y, x, horz), (y, x + sx, vert), (y, x, vert), (y + sy, x, horz)))
+            y += sy
+            x += sx
+            i += 1
+            j += 1
+    return steps
+
+
+@functools.lru_cache(maxsize=2)
+def _sight_lines(h, w, radius, group_edges = 1 << 18):
+    '''Every (dy, dx) offset within radius (Chebyshev, None for the whole maze)
+    except (0, 0) with its ray, as a list of groups of [m, 2] offsets and
+    [m, L, 4] int32 edge ids into a flat [4 * h * w] mask, relative to the
+    first cell. Shorter rays repeat their last step.
+
+    Rays are grouped by length, up to about group_edges edge ids per group,
+    so little is spent on padding: the whole-maze templates take about
+    32 * h * w * (h + w) bytes, e.g. 64 MB at 100x100, while a view_radius
+    template is one small group.'''
+    ry = h - 1 if radius is None else min(radius, h - 1)
+    rx = w - 1 if radius is None else min(radius, w - 1)
+    offsets = [(dy, dx) for dy in range(-ry, ry + 1) for dx in range(-rx, rx + 1) if dy or dx]
+    offsets.sort(key=lambda o: abs(o[0]) + abs(o[1]))
+    n = h * w
+    groups = []
+    start = 0
+    while start < len(offsets):
+        end = start + 1
+        while end < len(offsets) and (end + 1 - start) * (abs(offsets[end][0]) + abs(offsets[end][1])) * 4 <= group_edges:
+            end += 1
+        group = offsets[start:end]
+        length = abs(group[-1][0]) + abs(group[-1][1])
+        edges = np.empty([len(group), length, 4], dtype=np.int32)
+        for k, (dy, dx) in enumerate(group):
+            line = [[d * n + y * w + x for y, x, d in step] for step in _sight_line(dy, dx)]
+            edges[k, :len(line)] = line
+            edges[k, len(line):] = line[-1]
+        groups.append((np.array(group, dtype=np.int64).reshape(-1, 2), edges))
+        start = end
+    return groups
+
+
+class VisibilityIndex:
+    '''Cells in line of sight of each cell of one maze, as bitsets.
+
+    Walls (field[0:4]) block sight and windows (field[4:8]) let it
+    through. A ray runs between cell centres, so a cell sees along
+    corridors and through windows but not around corners. With radius
+    only cells within that Chebyshev distance are seen.
+
+    The visible set of a cell is computed on first use and kept as one
+    np.packbits row of h*w bits, so the per step cost of a partial
+    observation is a few cached row lookups and ORs. Rows are kept within
+    cache_bytes, least recently used first out, like Labyrinth.distance.
+    Built by Labyrinth.visibility and dropped with the maze.
+
+    Without radius a row costs O(h*w*(h+w)) (about 16 ms at 100x100) and
+    the ray templates about 32*h*w*(h+w) bytes, so large mazes should use
+    a radius; Hide_Seek requires one beyond full_view_cells.
+    '''
+    cache_bytes = 4 << 20
+
+    def __init__(self, labyrinth, radius = None) -> None:
+        self.h, self.w = labyrinth.h, labyrinth.w
+        self.radius = radius
+        self._sight = pathing.passable(labyrinth.field, windows=True).ravel()
+        self._rows = {}
+
+    def _compute(self, y, x) -> np.ndarray:
+        visible = np.zeros([self.h, self.w], dtype=bool)
+        visible[y, x] = True
+        src = y * self.w + x
+        # one gather per group of rays, so the temporaries stay as small as a group
+        for offsets, edges in _sight_lines(self.h, self.w, self.radius):
+            ty, tx = y + offsets[:, 0], x + offsets[:, 1]
+            inside = (ty >= 0) & (ty < self.h) & (tx >= 0) & (tx < self.w)
+            # a ray between two cells of the maze never leaves it, so no edge id wraps
+            sight = self._sight[edges[inside] + src]
+            seen = ((sight[..., 0] & sight[..., 1]) | (sight[..., 2] & sight[..., 3])).all(axis=-1)
+            visible[ty[inside][seen], tx[inside][seen]] = True
+        return np.packbits(visible)
+
+    def row(self, y, x) -> np.ndarray:
+        '''Packed bitset of the cells visible from (y, x)'''
+        src = y * self.w + x
+        # re-inserting keeps the dict in least to most recently used order
+        row = self._rows.pop(src, None)
+        if row is None:
+            row = self._compute(y, x)
+            if len(self._rows) >= max(1, self.cache_bytes // row.nbytes):
+                del self._rows[next(iter(self._rows))]
+        self._rows[src] = row
+        return row
+
+    def table(self) -> np.ndarray:
+        '''[h*w, ceil(h*w/8)] bitsets of every cell'''
+        return np.stack([self.row(*divmod(src, self.w)) for src in range(self.h * self.w)])
+
+    def visible(self, cells) -> np.ndarray:
+        '''[h, w] mask of the cells visible from any of the (y, x) cells'''
+        cells = iter(cells)
+        y, x = next(cells)
+        bits = self.row(y, x)
+        for y, x in cells:
+            bits = bits | self.row(y, x)
+        return np.unpackbits(bits, count=self.h * self.w).astype(bool).reshape(self.h, self.w)
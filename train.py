@@ -27,19 +27,81 @@ def _get_args():
     env_args.add_argument('--env-config', type=str, required=True, help='The environment config file')
     env_args.add_argument('--render-env', action='store_true')
     env_args.add_argument('--record-env', nargs='?', default=False, const=True)
+    env_args.add_argument('--profile-env', action='store_true', help='Report per-phase env step timings as custom metrics')
+    env_args.add_argument('--curriculum', type=str, help='JSON file with maze "levels" and the "promote_reward" that moves to the next one')
 
     args = parser.parse_args()
     return args
 
+def _profile_callbacks(base):
+    class ProfileCallbacks(base):
+        '''Turn the env's per-phase timings into <phase>_us_per_step custom metrics'''
+        def on_episode_end(self, *, worker, base_env, policies, episode, **kwargs):
+            super().on_episode_end(worker=worker, base_env=base_env, policies=policies, episode=episode, **kwargs)
+            for agent in episode.get_agents():
+                profile = episode.last_info_for(agent).get('profile')
+                if profile:
+                    steps = max(profile['steps'], 1)
+                    for phase, seconds in profile.items():
+                        if phase != 'steps':
+                            episode.custom_metrics['env_{}_us_per_step'.format(phase)] = seconds / steps * 1e6
+                    break
+
+    return ProfileCallbacks
+
+def _curriculum_callbacks(base, levels, promote_reward):
+    class CurriculumCallbacks(base):
+        '''Move every env to the next maze level once episode_reward_mean reaches promote_reward'''
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.level = 0
+
+        def on_train_result(self, *, trainer, result, **kwargs):
+            super().on_train_result(trainer=trainer, result=result, **kwargs)
+            if result['episode_reward_mean'] >= promote_reward and self.level + 1 < len(levels):
+                self.level += 1
+                level = levels[self.level]
+                upcoming = levels[self.level + 1] if self.level + 1 < len(levels) else None
+                def promote(env):
+                    env.set_level(**level)
+                    if upcoming is not None:
+                        env.maze_service.request(**upcoming)
+                trainer.workers.foreach_worker(lambda w: w.foreach_env(promote))
+            result['custom_metrics']['curriculum_level'] = self.level
+
+    return CurriculumCallbacks
+
+def _curriculum_config(env_config, curriculum):
+    '''Start the env at the first level, with observations sized for the largest one'''
+    levels = curriculum['levels']
+    previous = env_config
+    for level in levels: # a level keeps the difficulty of the previous one unless it sets its own
+        for key in ('h', 'w', 'connectivity', 'window_ratio'):
+            level.setdefault(key, previous[key])
+        previous = level
+    env_config.update(levels[0])
+    env_config['max_size'] = [max(level['h'] for level in levels), max(level['w'] for level in levels)]
+    service = dict(env_config.get('maze_service') or {})
+    service['buckets'] = [(level['h'], level['w'], level['connectivity'], level['window_ratio']) for level in levels[:2]]
+    env_config['maze_service'] = service
+
 def _get_config(args):
     import gym_hideseek.env
     from ray.tune.registry import register_env
+    env_creator = None
     if args.env == 'TD-Hider':
-        register_env('TD-Hider-v0', lambda c: gym_hideseek.env.Hider(**c))
+        env_creator = lambda c: gym_hideseek.env.Hider(**c)
+        register_env('TD-Hider-v0', env_creator)
         env = 'TD-Hider-v0'
     elif args.env == 'TD-Seeker':
-        register_env('TD-Seeker-v0', lambda c: gym_hideseek.env.Seeker(**c))
+        env_creator = lambda c: gym_hideseek.env.Seeker(**c)
+        register_env('TD-Seeker-v0', env_creator)
         env = 'TD-Seeker-v0'
+    elif args.env == 'TD-HideSeek':
+        from gym_hideseek.env.multi_agent import HideSeekMultiAgent
+        env_creator = lambda c: HideSeekMultiAgent(**c)
+        register_env('TD-HideSeek-v0', env_creator)
+        env = 'TD-HideSeek-v0'
     else:
         logger.warn('main', 'Unknown environment {}', args.env)
         env = args.env
@@ -49,6 +111,25 @@ def _get_config(args):
         model_config = json.load(f)
     with open(args.env_config, 'r') as f:
         env_config = json.load(f)
+    if args.profile_env:
+        env_config['profile'] = True
+    if args.render_env or args.record_env:
+        # RLlib calls env.render() without a mode; draw frames off-screen
+        # instead of opening a viewer, so rendering works without a display
+        env_config.setdefault('render_mode', 'rgb_array')
+    curriculum = None
+    if args.curriculum:
+        with open(args.curriculum, 'r') as f:
+            curriculum = json.load(f)
+        _curriculum_config(env_config, curriculum)
+    
+    # a last conv filter with kernel "obs" spans the whole observation, so the
+    # model follows the maze size and obs_crop of the env config
+    conv_filters = model_config.get('conv_filters')
+    if conv_filters and conv_filters[-1][1] == 'obs':
+        if env_creator is None:
+            raise ValueError('Cannot size the "obs" conv filter for environment {}'.format(args.env))
+        conv_filters[-1][1] = list(env_creator(env_config).observation_space.shape[:2])
     
     config = {
         'env': env,
@@ -57,10 +138,29 @@ def _get_config(args):
         'num_workers': args.num_workers,
         'model': model_config,
         'lr': args.lr,
-        # 'render_env': args.render_env,
-        # 'record_env': args.record_env,
+        'render_env': args.render_env,
+        'record_env': args.record_env,
         'num_gpus': 1,
     }
+    if args.profile_env or curriculum:
+        from ray.rllib.agents.callbacks import DefaultCallbacks
+        callbacks = DefaultCallbacks
+        if args.profile_env:
+            callbacks = _profile_callbacks(callbacks)
+        if curriculum:
+            callbacks = _curriculum_callbacks(callbacks, curriculum['levels'], curriculum['promote_reward'])
+        config['callbacks'] = callbacks
+    
+    if args.env == 'TD-HideSeek':
+        # self-play: one policy per side, trained together in the same run
+        probe = env_creator(env_config)
+        config['multiagent'] = {
+            'policies': {
+                agent: (None, probe.observation_spaces[agent], probe.action_spaces[agent], {})
+                for agent in probe.agents if agent != probe.scripted
+            },
+            'policy_mapping_fn': lambda agent_id, *args, **kwargs: agent_id,
+        }
 
     stop = {
         "training_iteration": args.stop_iters,
@@ -90,7 +190,11 @@ if __name__ == '__main__':
                 break
     else:
         from ray.tune import CLIReporter
-        reporter = CLIReporter(max_progress_rows=10, metric_columns=['episode_reward_mean', 'episodes_this_iter'])
+        metric_columns = ['episode_reward_mean', 'episodes_this_iter']
+        if args.profile_env:
+            from gym_hideseek.env.hide_seek import Hide_Seek
+            metric_columns += ['custom_metrics/env_{}_us_per_step_mean'.format(phase) for phase in Hide_Seek.phases]
+        reporter = CLIReporter(max_progress_rows=10, metric_columns=metric_columns)
         results = tune.run(args.method, config=config, stop=stop, progress_reporter=reporter)
         if args.as_test:
             from ray.rllib.utils.test_utils import check_learning_achieved